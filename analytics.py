@@ -0,0 +1,170 @@
+"""Partnership and head-to-head records between players.
+
+Every match stores full team lists, so "how do A and B do on the same side"
+and "what is A's record against B" only need counting.  :class:`PairStats`
+keeps four sparse player x player counts in CSR form (row offsets, partner
+columns, one value array per count): games together, wins together, games
+against and wins against, the last from the row player's side.  Building it
+generates every pair of players in every match at once with NumPy.
+
+Shared between sessions like the rest of the derived data, so never changed
+in place.  A newly recorded match goes into a small per-player overlay in a
+new PairStats that reuses the matrix; once the overlay grows past
+``REBUILD_AFTER`` pairs the next update rebuilds instead.
+"""
+
+import numpy as np
+import pandas as pd
+
+from league_model import appended_since, history_mark
+
+# Overlay pairs after which the matrix is rebuilt from the history
+REBUILD_AFTER = 20000
+
+COUNTS = ['together', 'together_won', 'against', 'against_won']
+
+
+def _appearances(matches):
+    """(match, team, player name, won) columns, one row per player per match"""
+    match_col, team_col, player_col, won_col = [], [], [], []
+    team_no = 0
+    for m, match in enumerate(matches):
+        for team in match['teams']:
+            for name in team['players']:
+                match_col.append(m)
+                team_col.append(team_no)
+                player_col.append(name)
+                won_col.append(team['name'] == match['winner'])
+            team_no += 1
+    return np.array(match_col, dtype=np.int64), np.array(team_col, dtype=np.int64), player_col, np.array(won_col, dtype=bool)
+
+
+def _match_pairs(match):
+    """{(player, other): counts} for one match, both directions"""
+    pairs = {}
+    sides = [(team['players'], team['name'] == match['winner']) for team in match['teams']]
+    for t, (players, won) in enumerate(sides):
+        for u, (others, _) in enumerate(sides):
+            for a in players:
+                for b in others:
+                    if a != b:
+                        pairs[(a, b)] = (1, int(won), 0, 0) if t == u else (0, 0, 1, int(won))
+    return pairs
+
+
+class PairStats:
+    """Together/against counts for every pair of players who shared a match"""
+
+    def __init__(self, matches):
+        self.mark = history_mark(matches)
+        self.overlay = {}
+        self.overlay_size = 0
+        match, team, player_names, won = _appearances(matches)
+        codes, names = pd.factorize(pd.Series(player_names, dtype=object))
+        self.names = list(names)
+        self.codes = {name: i for i, name in enumerate(self.names)}
+        n = len(self.names)
+
+        # Appearances are grouped by match already; pair each with every row of its match
+        sizes = np.bincount(match, minlength=len(matches))
+        starts = np.concatenate([[0], np.cumsum(sizes)])[:-1]
+        per_row = sizes[match]
+        left = np.repeat(np.arange(len(match)), per_row)
+        block = np.repeat(np.cumsum(per_row) - per_row, per_row)
+        right = starts[match][left] + np.arange(len(left)) - block
+        keep = codes[left] != codes[right]
+        left, right = left[keep], right[keep]
+
+        keys, inverse = np.unique(codes[left].astype(np.int64) * n + codes[right], return_inverse=True)
+        same = team[left] == team[right]
+        wins = won[left]
+        counts = {
+            'together': same,
+            'together_won': same & wins,
+            'against': ~same,
+            'against_won': ~same & wins
+        }
+        self.values = {c: np.bincount(inverse, weights=w, minlength=len(keys)).astype(np.int64) for c, w in counts.items()}
+        rows = keys // max(n, 1)
+        self.columns = keys % max(n, 1)
+        self.offsets = np.searchsorted(rows, np.arange(n + 1))
+
+    def updated(self, matches):
+        """These counts plus the matches appended since, or None if more changed"""
+        appended = appended_since(matches, self.mark)
+        if appended is None:
+            return None
+        new = object.__new__(PairStats)
+        new.__dict__.update(self.__dict__)
+        new.mark = history_mark(matches)
+        new.overlay = dict(self.overlay)
+        copied = set()
+        for match in appended:
+            for (a, b), counts in _match_pairs(match).items():
+                if a not in copied:
+                    new.overlay[a] = dict(new.overlay.get(a, {}))
+                    copied.add(a)
+                old = new.overlay[a].get(b)
+                if old is None:
+                    new.overlay_size += 1
+                    new.overlay[a][b] = counts
+                else:
+                    new.overlay[a][b] = tuple(x + y for x, y in zip(old, counts))
+        if new.overlay_size > REBUILD_AFTER:
+            return None
+        return new
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def row(self, name):
+        """Counts between ``name`` and everyone they've played with or against, by name"""
+        i = self.codes.get(name)
+        if i is None:
+            frame = pd.DataFrame(columns=COUNTS, dtype=np.int64)
+        else:
+            lo, hi = self.offsets[i], self.offsets[i + 1]
+            frame = pd.DataFrame(
+                {c: self.values[c][lo:hi] for c in COUNTS},
+                index=[self.names[j] for j in self.columns[lo:hi]]
+            )
+        extra = self.overlay.get(name)
+        if extra:
+            frame = frame.add(pd.DataFrame.from_dict(extra, orient='index', columns=COUNTS), fill_value=0).astype(np.int64)
+        return frame
+
+    def together(self, a, b):
+        """(games, wins) with ``a`` and ``b`` on the same team"""
+        row = self.row(a)
+        if b not in row.index:
+            return 0, 0
+        return int(row.at[b, 'together']), int(row.at[b, 'together_won'])
+
+    def against(self, a, b):
+        """(games, wins for ``a``) with ``a`` and ``b`` on opposite teams"""
+        row = self.row(a)
+        if b not in row.index:
+            return 0, 0
+        return int(row.at[b, 'against']), int(row.at[b, 'against_won'])
+
+    def partners(self, name, min_games=1, top=10):
+        """Best teammates by win rate together, among pairs with ``min_games`` or more"""
+        return self._ranked(name, 'together', min_games, top, ascending=False)
+
+    def rivals(self, name, min_games=1, top=10):
+        """Toughest opponents: lowest win rate against, among pairs with ``min_games`` or more"""
+        return self._ranked(name, 'against', min_games, top, ascending=True)
+
+    def _ranked(self, name, kind, min_games, top, ascending):
+        row = self.row(name)
+        row = row[row[kind] >= max(min_games, 1)]
+        table = pd.DataFrame({
+            'Player': row.index,
+            'Games': row[kind].to_numpy(),
+            'Wins': row[f'{kind}_won'].to_numpy()
+        })
+        table['Win Rate'] = table['Wins'] * 100.0 / table['Games']
+        table = table.sort_values(['Win Rate', 'Games'], ascending=[ascending, False], kind='stable').head(top)
+        table['Win Rate'] = [f"{r:.1f}%" for r in table['Win Rate']]
+        return table.reset_index(drop=True)
@@ -0,0 +1,272 @@
+"""Read-only JSON API for bots and displays.
+
+The group bot and the lobby display used to scrape the Streamlit pages, each
+scrape a full session loading every sheet.  This serves the same data as
+JSON from the process-wide cache the app already keeps:
+
+    GET /api/games          upcoming games with their votes
+    GET /api/leaderboard    player rankings; ?season=2025 or ?last=10 for a window
+    GET /api/matches        recent results, newest first; ?limit=10 (at most 50)
+
+A response body is built once per version of the data it comes from and kept
+with an ETag, so a client sending ``If-None-Match`` gets a bodiless 304 while
+nothing changed, and ``Cache-Control`` lets well-behaved pollers skip asking
+at all for a few seconds.
+
+Runs inside the Streamlit process when ``api_port`` is set under
+``[storage]`` (or ``LEAGUE_API_PORT``), or on its own::
+
+    python api.py --port 8502
+
+Either way it listens on localhost only unless ``api_host`` (or ``--host``)
+says otherwise, e.g. ``0.0.0.0`` to let the displays on the network in.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import tomllib
+from collections import OrderedDict
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from diagnostics import PROFILER
+from league_cache import CachedStorage
+from ratings import Ratings, replay
+from stats import LeagueStats
+from storage import open_storage, storage_config
+
+# Seconds clients may reuse a response without asking again
+CACHE_SECONDS = 15
+
+MAX_MATCHES = 50
+
+# Built responses kept, one per path and query
+RESPONSES_KEPT = 64
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _jsonable(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    raise TypeError(f"Can't encode {type(value).__name__} as JSON")
+
+
+def _int(query, name, low, high):
+    try:
+        value = int(query[name][0])
+    except ValueError:
+        raise BadRequest(f"{name} must be a whole number")
+    if not low <= value <= high:
+        raise BadRequest(f"{name} must be between {low} and {high}")
+    return value
+
+# ============================================================================
+# PAYLOADS
+# ============================================================================
+
+def games_payload(games, today):
+    upcoming = sorted((g for g in games if str(g['date']) >= today), key=lambda g: (str(g['date']), g['id']))
+    return {'games': [{
+        'id': g['id'],
+        'date': str(g['date']),
+        'time': str(g['time']),
+        'location': g['location'],
+        'type': g['type'],
+        'max_players': g['max_players'],
+        'votes': len(g['votes']),
+        'players': list(g['votes'])
+    } for g in upcoming]}
+
+
+def leaderboard_payload(players, stats, ratings, window):
+    table = stats.player_stats(players, window).sort_values('points', ascending=False, kind='stable')
+    return {
+        'matches': len(stats.match_days) if window is None else window[1] - window[0],
+        'players': [{
+            'rank': rank,
+            'player': name,
+            'points': row['points'],
+            'matches': row['matches_played'],
+            'wins': row['matches_won'],
+            'win_rate': round(row['win_rate'], 1),
+            'rating': row['rating'],
+            'skill': round(ratings.get(name), 1)
+        } for rank, (name, row) in enumerate(table.iterrows(), 1)]
+    }
+
+
+def matches_payload(matches, limit):
+    return {'matches': [{
+        'id': m['id'],
+        'date': str(m['date']),
+        'winner': m['winner'],
+        'teams': [{'name': t['name'], 'captain': t['captain'], 'players': list(t['players'])} for t in m['teams']]
+    } for m in reversed(matches[-limit:])]}
+
+# ============================================================================
+# SERVER
+# ============================================================================
+
+class LeagueAPI:
+    """Turns GET requests into (status, body, etag) from a :class:`league_cache.CachedStorage`"""
+
+    def __init__(self, store):
+        self.store = store
+        self.responses = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _route(self, path, query):
+        """(datasets read, cache key, build(data) -> payload)"""
+        if path == '/api/games':
+            today = date.today().isoformat()
+            return ['games'], (path, today), lambda data: games_payload(data['games'], today)
+
+        if path == '/api/leaderboard':
+            if 'season' in query:
+                option = ('season', _int(query, 'season', 1900, 2999))
+            elif 'last' in query:
+                option = ('last', _int(query, 'last', 1, 100000))
+            else:
+                option = None
+
+            def build(data):
+                history = data['matches']
+                stats = self.store.derived('stats', LeagueStats, *history, update=LeagueStats.updated)
+                ratings = self.store.derived('ratings', replay, data['players'], history[0], update=Ratings.updated)
+                window = None
+                if option and option[0] == 'season':
+                    window = stats.season(option[1])
+                elif option:
+                    window = stats.last_matches(option[1])
+                return leaderboard_payload(data['players'], stats, ratings, window)
+
+            return ['players', 'matches'], (path, option), build
+
+        if path == '/api/matches':
+            limit = _int(query, 'limit', 1, MAX_MATCHES) if 'limit' in query else 10
+            return ['matches'], (path, limit), lambda data: matches_payload(data['matches'][0], limit)
+
+        return None
+
+    def respond(self, target):
+        """(status, body bytes, etag or None) for a GET of ``target``"""
+        url = urlsplit(target)
+        try:
+            route = self._route(url.path.rstrip('/'), parse_qs(url.query))
+        except BadRequest as e:
+            return 400, json.dumps({'error': str(e)}).encode(), None
+        if route is None:
+            return 404, json.dumps({'error': f"No such endpoint: {url.path}"}).encode(), None
+        names, key, build = route
+
+        with PROFILER.timed(f"api.{key[0].removeprefix('/api/')}"):
+            data = self.store.load_shared(names)
+            # Shared data is replaced, never changed, so the same objects mean the same answer
+            sources = tuple(data[name] for name in names)
+            with self.lock:
+                kept = self.responses.get(key)
+                if kept is not None and all(a is b for a, b in zip(kept[0], sources)):
+                    self.responses.move_to_end(key)
+                    return 200, kept[1], kept[2]
+            body = json.dumps(build(data), default=_jsonable).encode()
+            etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+            with self.lock:
+                self.responses[key] = (sources, body, etag)
+                self.responses.move_to_end(key)
+                while len(self.responses) > RESPONSES_KEPT:
+                    self.responses.popitem(last=False)
+            return 200, body, etag
+
+
+def _matches_etag(header, etag):
+    if not header or etag is None:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or any(t.removeprefix('W/') == etag for t in tags)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'LeagueAPI/1'
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        try:
+            status, body, etag = self.server.api.respond(self.path)
+        except Exception as e:
+            # Storage is unreachable: say so rather than serving nothing as data
+            status, body, etag = 503, json.dumps({'error': str(e)}).encode(), None
+
+        if status == 200 and _matches_etag(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', f"public, max-age={CACHE_SECONDS}")
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', f"public, max-age={CACHE_SECONDS}")
+        else:
+            self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Pollers would fill the log; timings go to the profiler instead
+        pass
+
+
+def serve(store, port, host='127.0.0.1'):
+    """Start the API on a daemon thread and return the server"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.api = LeagueAPI(store)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', help="default: api_host from [storage], else 127.0.0.1")
+    parser.add_argument('--port', type=int, default=8502)
+    args = parser.parse_args()
+
+    secrets = {}
+    if os.path.exists('.streamlit/secrets.toml'):
+        with open('.streamlit/secrets.toml', 'rb') as f:
+            secrets = tomllib.load(f)
+    config = storage_config(secrets)
+    # Read-only and in a process of its own: the write-behind log and the
+    # snapshot files belong to the app
+    config.update(write_behind=False, snapshot=False)
+    store = CachedStorage(open_storage(config, secrets.get('gcp_service_account')), ttl=config['cache_ttl'])
+
+    host = args.host or config['api_host']
+    server = ThreadingHTTPServer((host, args.port), _Handler)
+    server.api = LeagueAPI(store)
+    print(f"Serving the league API on http://{host}:{args.port}/api/")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""Benchmarks for the data layer, team generation and page frames.
+
+Generates synthetic leagues at several sizes and runs the storage load/save
+paths against an in-process fake of Google Sheets (or a temporary SQLite
+file), then the team generator and the Leaderboard/Players frames.  For each
+step it reports wall time, Sheets API calls and peak Python memory.
+
+    python bench.py                     # small and medium leagues
+    python bench.py --sizes large       # 5,000 players / 100k matches
+    python bench.py --latency 0.1       # pretend every API call takes 100 ms
+    python bench.py --backend sqlite
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from analytics import PairStats
+from fake_sheets import FakeSpreadsheet
+from ratings import replay
+from snapshot import SnapshotStorage
+from stats import LeagueStats
+from storage import VOTE_OUT, SheetsStorage, SQLiteStorage, next_match_id
+from team_balancer import balance_teams, pairing_counts, team_options
+
+# name: (players, matches, games)
+SIZES = {
+    'small': (50, 10, 5),
+    'medium': (500, 1000, 50),
+    'large': (5000, 100000, 500),
+}
+
+STRENGTHS = ["Batsman", "Bowler", "All-rounder", "Wicket Keeper"]
+
+# Voters in every game and teams per match: the game-day case
+VOTERS = 50
+NUM_TEAMS = 4
+
+# ============================================================================
+# SYNTHETIC LEAGUE
+# ============================================================================
+
+def make_league(num_players, num_matches, num_games, seed=0):
+    """Players, games with full vote lists, and a match history"""
+    rng = random.Random(seed)
+    players = [{
+        'name': f"Player {i:05d}",
+        'rating': rng.randint(1, 10),
+        'strength': rng.choice(STRENGTHS),
+        'matches_played': 0,
+        'matches_won': 0,
+        'points': 0
+    } for i in range(num_players)]
+    names = [p['name'] for p in players]
+    voters = min(VOTERS, num_players)
+
+    # Games are upcoming, so saving them doesn't move them to the archive
+    games = [{
+        'id': i + 1,
+        'date': str(date.today() + timedelta(days=7 * i)),
+        'time': '09:00:00',
+        'location': 'Central Park',
+        'type': 'Internal',
+        'max_players': voters,
+        'votes': rng.sample(names, voters),
+        'created_by': 'Master Admin'
+    } for i in range(num_games)]
+
+    start = date(2024, 1, 1)
+    matches = []
+    for i in range(num_matches):
+        squad = rng.sample(names, min(22, num_players))
+        teams = [{
+            'name': f"Team {chr(65 + t)}",
+            'captain': squad[t::2][0],
+            'players': squad[t::2],
+            'strength': 0
+        } for t in range(2)]
+        matches.append({
+            'id': i + 1,
+            'date': str(start + timedelta(days=i % 3650)),
+            'game_id': i % max(num_games, 1) + 1,
+            'teams': teams,
+            'winner': teams[rng.randrange(2)]['name'],
+            'num_teams': 2
+        })
+    return players, games, matches
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+class Bench:
+    def __init__(self, spreadsheet, trace_memory):
+        self.spreadsheet = spreadsheet
+        self.trace_memory = trace_memory
+        self.results = []
+
+    def run(self, label, fn):
+        calls = self.spreadsheet.total_calls() if self.spreadsheet else 0
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = fn()
+        wall = time.perf_counter() - start
+        peak = 0
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        api_calls = self.spreadsheet.total_calls() - calls if self.spreadsheet else 0
+        self.results.append((label, wall, api_calls, peak))
+        return result
+
+
+def run_size(name, backend, latency, trace_memory):
+    num_players, num_matches, num_games = SIZES[name]
+    players, games, matches = make_league(num_players, num_matches, num_games)
+
+    spreadsheet = None
+    if backend == 'sheets':
+        spreadsheet = FakeSpreadsheet()
+        store = SheetsStorage(spreadsheet)
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        store = SQLiteStorage(path)
+
+    bench = Bench(spreadsheet, trace_memory)
+
+    # Seed the sheet without latency, then switch it on for the measured steps
+    store.save_players(players)
+    store.save_games(games)
+    store.save_matches(matches)
+    if spreadsheet:
+        spreadsheet.latency = latency
+
+    bench.run("load players", store.load_players)
+    bench.run("load games", store.load_games)
+    loaded_matches, appearances = bench.run("load matches + appearances", store.load_history)
+    bench.run("load all datasets (one batch)", lambda: store.load_many(['players', 'games', 'matches']))
+    if spreadsheet:
+        snapshot_dir = tempfile.mkdtemp()
+        datasets = ['players', 'games', 'matches']
+        bench.run("cold start, no snapshot", lambda: SnapshotStorage(store, snapshot_dir).load_many(datasets))
+        bench.run("cold start from snapshot", lambda: SnapshotStorage(store, snapshot_dir).load_many(datasets))
+
+    players[0]['rating'] = players[0]['rating'] % 10 + 1
+    bench.run("save players (1 changed)", lambda: store.save_players(players))
+
+    games[0]['votes'].pop()
+    bench.run("save games (1 vote)", lambda: store.save_games(games))
+    bench.run("cast vote (uncached)", lambda: store.cast_vote(games[0]['id'], games[0]['votes'][0], VOTE_OUT))
+
+    new_match = dict(matches[-1], id=next_match_id(loaded_matches))
+    bench.run("record match", lambda: store.append_match(new_match))
+
+    voters = [p for p in players if p['name'] in set(games[0]['votes'])]
+    bench.run(f"generate teams ({len(voters)} voters, {NUM_TEAMS} teams)", lambda: balance_teams(voters, NUM_TEAMS))
+    bench.run(f"team options with history ({len(voters)} voters)", lambda: team_options(
+        voters, NUM_TEAMS, pairing_counts(loaded_matches, [p['name'] for p in voters])
+    ))
+
+    stats = bench.run("build stats", lambda: LeagueStats(loaded_matches, appearances))
+    learned = bench.run("replay ratings", lambda: replay(players, loaded_matches))
+    latest = dict(new_match, date=max(str(m['date']) for m in loaded_matches))
+    bench.run("stats one new match", lambda: stats.updated(loaded_matches + [latest]))
+    bench.run("rate one new match", lambda: learned.updated(players, loaded_matches + [new_match]))
+    pairs = bench.run("build pair stats", lambda: PairStats(loaded_matches))
+    bench.run("pair stats one new match", lambda: pairs.updated(loaded_matches + [new_match]))
+    bench.run("partners + rivals", lambda: (pairs.partners(voters[0]['name']), pairs.rivals(voters[0]['name'])))
+    bench.run("leaderboard frame", lambda: stats.leaderboard(players))
+    bench.run("season leaderboard frame", lambda: stats.leaderboard(players, stats.season(stats.seasons()[-1])))
+    bench.run("players frame", lambda: stats.player_stats(players))
+
+    return bench.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='small,medium', help="comma-separated: " + ', '.join(SIZES))
+    parser.add_argument('--backend', choices=['sheets', 'sqlite'], default='sheets')
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every fake API call")
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc for cleaner timings")
+    args = parser.parse_args()
+
+    for name in args.sizes.split(','):
+        num_players, num_matches, num_games = SIZES[name]
+        print(f"\n{name}: {num_players} players, {num_matches} matches, {num_games} games ({args.backend})")
+        print(f"{'step':<42}{'wall ms':>10}{'API calls':>11}{'peak MB':>10}")
+        for label, wall, api_calls, peak in run_size(name, args.backend, args.latency, not args.no_memory):
+            print(f"{label:<42}{wall * 1000:>10.1f}{api_calls:>11}{peak / 1e6:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
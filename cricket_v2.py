@@ -1,122 +1,173 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
-import gspread
-from google.oauth2.service_account import Credentials
-import json
+from datetime import datetime, date
+from storage import storage_config, open_storage, VOTE_IN, VOTE_OUT
+from league_cache import CachedStorage
+from team_balancer import team_options, pairing_counts
+from league_model import League
+from stats import LeagueStats
+from ratings import Ratings, replay
+from analytics import PairStats
+from diagnostics import PROFILER, ProfiledStorage, begin_rerun, end_rerun, QUOTA_PER_MINUTE
+import api
 
 st.set_page_config(page_title="PK Expat Cricket", page_icon="🏏", layout="wide")
 
+# Times this run section by section for the Diagnostics page
+rerun_timer = begin_rerun(st.session_state)
+rerun_timer.section("setup")
+
 # ============================================================================
-# GOOGLE SHEETS SETUP
+# STORAGE SETUP
 # ============================================================================
 
-# Credentials from Streamlit secrets
-SCOPES = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive'
-]
+# Google Sheets by default; set backend = "sqlite" under [storage] in the
+# secrets (or LEAGUE_STORAGE=sqlite) to run against a local database file
+STORAGE_CONFIG = storage_config(st.secrets)
+
+@st.cache_resource
+def get_store():
+    """One cached storage for every session in this process"""
+    if STORAGE_CONFIG['backend'] == 'sheets':
+        # Credentials from Streamlit secrets
+        backend = open_storage(STORAGE_CONFIG, st.secrets["gcp_service_account"])
+    else:
+        backend = open_storage(STORAGE_CONFIG)
+    # Sessions share one in-memory copy; saves swap in a new version of it
+    return ProfiledStorage(CachedStorage(backend, ttl=STORAGE_CONFIG['cache_ttl']))
+
+store = get_store()
 
-# Get credentials from secrets
-credentials_dict = st.secrets["gcp_service_account"]
-credentials = Credentials.from_service_account_info(credentials_dict, scopes=SCOPES)
-gc = gspread.authorize(credentials)
+@st.cache_resource
+def start_api():
+    """JSON API for bots and displays over the same cache, once per process.
 
-# Open the spreadsheet
-SHEET_ID = "1D7UKzNNOQczbO5puSbGWHFwRt58Erk_G44hleUlMZlg"
-sh = gc.open_by_key(SHEET_ID)
+    Returns (server, None), or (None, error) if the port can't be bound.
+    """
+    try:
+        return api.serve(store, STORAGE_CONFIG['api_port'], STORAGE_CONFIG['api_host']), None
+    except OSError as e:
+        # E.g. a second app process already serves it: run without the API
+        return None, e
 
-# Get worksheets
-players_sheet = sh.worksheet("Players")
-matches_sheet = sh.worksheet("Matches")
-games_sheet = sh.worksheet("Games")
+api_error = start_api()[1] if STORAGE_CONFIG['api_port'] else None
 
 # ============================================================================
 # DATA PERSISTENCE FUNCTIONS
 # ============================================================================
 
+# Each write hands the session the shared version that includes it
+
 def save_players(players):
-    """Save players to Google Sheets"""
-    players_sheet.clear()
-    if players:
-        # Header
-        players_sheet.append_row(['name', 'rating', 'strength', 'matches_played', 'matches_won', 'points'])
-        # Data
-        for p in players:
-            players_sheet.append_row([
-                p['name'],
-                p['rating'],
-                p['strength'],
-                p['matches_played'],
-                p['matches_won'],
-                p['points']
-            ])
-
-def load_players():
-    """Load players from Google Sheets"""
-    try:
-        data = players_sheet.get_all_records()
-        return data if data else []
-    except:
-        return []
+    """Save players to storage"""
+    store.save_players(players)
+    refresh(['players'])
 
 def save_games(games):
-    """Save games to Google Sheets"""
-    games_sheet.clear()
-    if games:
-        # Header
-        games_sheet.append_row(['id', 'date', 'time', 'location', 'type', 'max_players', 'votes', 'created_by'])
-        # Data
-        for g in games:
-            games_sheet.append_row([
-                g['id'],
-                g['date'],
-                g['time'],
-                g['location'],
-                g['type'],
-                g['max_players'],
-                ','.join(g['votes']),  # Convert list to comma-separated string
-                g['created_by']
-            ])
-
-def load_games():
-    """Load games from Google Sheets"""
-    try:
-        data = games_sheet.get_all_records()
-        # Convert votes back to list
-        for game in data:
-            game['votes'] = game['votes'].split(',') if game['votes'] else []
-        return data if data else []
-    except:
-        return []
+    """Save games to storage (creating or deleting one; votes go through cast_vote)"""
+    store.save_games(games)
+    refresh(['games'])
 
-def save_matches(matches):
-    """Save matches to Google Sheets"""
-    matches_sheet.clear()
-    if matches:
-        # Header
-        matches_sheet.append_row(['date', 'game_id', 'winner', 'num_teams', 'teams_data'])
-        # Data
-        for m in matches:
-            matches_sheet.append_row([
-                m['date'],
-                m['game_id'],
-                m['winner'],
-                m['num_teams'],
-                json.dumps(m['teams'])  # Convert teams to JSON string
-            ])
-
-def load_matches():
-    """Load matches from Google Sheets"""
-    try:
-        data = matches_sheet.get_all_records()
-        # Convert teams back from JSON
-        for match in data:
-            match['teams'] = json.loads(match['teams_data'])
-            del match['teams_data']
-        return data if data else []
-    except:
+def cast_vote(game_id, player, action):
+    """Record one vote; False if it changed nothing, e.g. the game was full"""
+    changed, _ = store.cast_vote(game_id, player, action)
+    refresh(['games'])
+    return changed
+
+def record_match(match):
+    """Append one new match to storage; the store gives it its id"""
+    match = store.append_match(match)
+    refresh(['matches'])
+    return match
+
+def update_match(match):
+    """Replace a recorded match (rare: corrections only)"""
+    store.update_match(match)
+    refresh(['matches'])
+
+def delete_match(match_id):
+    """Remove a recorded match (rare: corrections only)"""
+    store.delete_match(match_id)
+    refresh(['matches'])
+
+# Datasets each page reads; anything else is left in storage until needed
+PAGE_DATA = {
+    "Login": ['players'],
+    "Upcoming Games": ['players', 'games'],
+    "Players": ['players', 'games', 'matches'],
+    "Team Generator": ['players', 'games', 'matches'],
+    "Match Results": ['players', 'games', 'matches'],
+    "Leaderboard": ['players', 'matches'],
+    "Player Profile": ['players', 'games', 'matches'],
+    "Diagnostics": []
+}
+
+# Game cards drawn per page of Upcoming Games
+GAMES_PER_PAGE = 5
+
+# Most recent matches an admin can pick from to correct or delete
+CORRECTABLE_MATCHES = 20
+
+# Seconds between checks for changes made by other sessions or processes
+REFRESH_SECONDS = 30
+
+def changed_datasets(names):
+    """Datasets in ``names`` this session holds an older version of than storage"""
+    versions = store.versions()
+    if versions is None:
         return []
+    held = st.session_state.setdefault('data_versions', {})
+    return [name for name in names if name in st.session_state and held.get(name) != versions.get(name)]
+
+def require(names):
+    """Load the datasets in ``names`` this session hasn't got yet, or that changed, in one batch.
+
+    The session gets references to the process-wide copies, not its own: treat
+    them as read-only and save changed copies instead.
+
+    Errors stop the page instead of being swallowed: an empty list here would
+    be saved back over the real data by the next write.
+    """
+    versions = store.versions()
+    missing = [name for name in names if name not in st.session_state] + changed_datasets(names)
+    if missing:
+        try:
+            data = store.load_shared(missing)
+        except Exception as e:
+            st.error(f"❌ Couldn't load league data: {e}")
+            st.stop()
+        for name, value in data.items():
+            if name == 'matches':
+                st.session_state.matches = value[0]
+                # Leaderboard numbers come from match history, not stored counters
+                st.session_state.stats = store.derived('stats', LeagueStats, *value, update=LeagueStats.updated)
+            else:
+                st.session_state[name] = value
+            st.session_state.setdefault('data_versions', {})[name] = versions.get(name) if versions else None
+        if 'players' in data or 'games' in data:
+            # Rebuilt below over the new lists
+            st.session_state.pop('league', None)
+    if 'league' not in st.session_state and 'players' in st.session_state and 'games' in st.session_state:
+        # Indexes over the same players/games lists, built once per version for everyone
+        st.session_state.league = store.derived('league', League, st.session_state.players, st.session_state.games)
+    if 'matches' in st.session_state and 'players' in st.session_state and (
+            'ratings' not in st.session_state or 'matches' in missing or 'players' in missing):
+        # Learned from results; a newly recorded match only moves its own players
+        st.session_state.ratings = store.derived(
+            'ratings', replay, st.session_state.players, st.session_state.matches, update=Ratings.updated
+        )
+
+def refresh(names):
+    """Swap this session's copies of ``names`` for the shared ones, e.g. after a write"""
+    for name in names:
+        st.session_state.pop(name, None)
+    require(names)
+
+@st.fragment(run_every=REFRESH_SECONDS)
+def watch_for_changes(names):
+    """Rerun the page once something it shows has changed elsewhere; draws nothing"""
+    if changed_datasets(names):
+        st.rerun()
 
 # ============================================================================
 # AUTHENTICATION
@@ -133,24 +184,233 @@ ADMIN_PASSWORDS = {
 # SESSION STATE INITIALIZATION
 # ============================================================================
 
+rerun_timer.section("session init")
+
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
 if 'user_role' not in st.session_state:
     st.session_state.user_role = None
 if 'username' not in st.session_state:
     st.session_state.username = None
-if 'games' not in st.session_state:
-    st.session_state.games = load_games()
-if 'players' not in st.session_state:
-    st.session_state.players = load_players()
-if 'matches' not in st.session_state:
-    st.session_state.matches = load_matches()
+# League data is loaded per page by require(), the first time a page needs it
+
+# ============================================================================
+# FRAGMENTS
+# ============================================================================
+# Widgets inside a fragment rerun only that fragment, not the whole script:
+# a vote redraws one game card, a captain change one team card.
+
+def vote_clicked(game_id, player, action):
+    """Vote button callback; runs before the card redraws, so it shows the result"""
+    if not cast_vote(game_id, player, action) and action == VOTE_IN:
+        st.session_state[f"game_full_{game_id}"] = True
+
+@st.fragment
+def game_card(game_id):
+    """One scheduled game with its votes and the vote/delete buttons"""
+    league = st.session_state.league
+    game = league.game(game_id)
+    if game is None:
+        return
+    with PROFILER.timed("fragment.game_card"):
+        with st.expander(f"🏏 {game['date']} - {game['location']} ({game['type']})"):
+            col1, col2, col3 = st.columns([2, 1, 1])
+            
+            with col1:
+                st.write(f"**📍 Location:** {game['location']}")
+                st.write(f"**🕐 Reporting Time:** {game['time']}")
+                st.write(f"**👥 Capacity:** {len(game['votes'])}/{game['max_players']}")
+            
+            with col2:
+                if game['votes']:
+                    st.write("**Players In:**")
+                    for player in game['votes']:
+                        st.write(f"✅ {player}")
+                else:
+                    st.info("No votes yet")
+            
+            with col3:
+                # PLAYER VOTING
+                if st.session_state.user_role == "player":
+                    player_name = st.session_state.username
+                    
+                    if league.has_voted(game['id'], player_name):
+                        st.success("✅ You're in!")
+                        st.button("❌ Cancel", key=f"cancel_{game['id']}",
+                                  on_click=vote_clicked, args=(game['id'], player_name, VOTE_OUT))
+                    else:
+                        st.button("✅ I'm In!", key=f"join_{game['id']}",
+                                  on_click=vote_clicked, args=(game['id'], player_name, VOTE_IN))
+                        if st.session_state.pop(f"game_full_{game['id']}", False):
+                            st.error("Game is full!")
+                
+                # ADMIN - Delete game
+                if st.session_state.user_role in ["master_admin", "admin"]:
+                    if st.button("🗑️ Delete", key=f"delete_{game['id']}"):
+                        save_games(league.without_game(game['id']).games)
+                        store.clear_votes(game['id'])
+                        # The list of cards changes, so redraw the page
+                        st.rerun()
+
+@st.fragment
+def team_card(i):
+    """Name, captain and players of generated team ``i``"""
+    team = st.session_state.generated_teams[i]
+    with PROFILER.timed("fragment.team_card"):
+        st.markdown(f"### Team {i+1}")
+        
+        st.text_input(f"Team Name", value=f"Team {chr(65+i)}", key=f"team_name_{i}")
+        
+        st.metric("Total Strength", st.session_state.team_strengths[i])
+        
+        if team:
+            captain = st.selectbox(
+                "Captain",
+                [p['name'] for p in team],
+                key=f"captain_{i}"
+            )
+            
+            st.write("**Players:**")
+            for player in team:
+                if player['name'] == captain:
+                    st.write(f"⭐ **{player['name']}** (C) - {player['strength']} (Rating: {player['rating']})")
+                else:
+                    st.write(f"• {player['name']} - {player['strength']} (Rating: {player['rating']})")
+        else:
+            st.warning("No players in this team")
+
+def option_picked():
+    """Option radio callback: load the chosen split into the team cards"""
+    option = st.session_state.team_options[st.session_state.team_option]
+    st.session_state.generated_teams = [list(team) for team in option['teams']]
+    st.session_state.team_strengths = list(option['strengths'])
+
+def move_clicked():
+    """Move Player callback: moves the player picked in the form before the teams redraw"""
+    picked = st.session_state.get("move_player")
+    if not picked:
+        return
+    teams = st.session_state.generated_teams
+    player_name = picked.split(" (Team")[0]
+    current_team_idx = int(picked.split("Team ")[1].rstrip(")")) - 1
+    dest_team_idx = int(st.session_state.move_to_team.split(" ")[1]) - 1
+    
+    for player in teams[current_team_idx]:
+        if player['name'] == player_name:
+            teams[current_team_idx].remove(player)
+            teams[dest_team_idx].append(player)
+            
+            strengths = st.session_state.team_strengths
+            strengths[current_team_idx] = round(strengths[current_team_idx] - player['rating'], 1)
+            strengths[dest_team_idx] = round(strengths[dest_team_idx] + player['rating'], 1)
+            
+            st.session_state.moved_player = player_name
+            break
+
+@st.fragment
+def team_review(num_teams, game_id):
+    """Team cards, the Move Players panel and Finalize; a move redraws just this"""
+    teams = st.session_state.generated_teams
+    
+    st.markdown("---")
+    st.subheader("4️⃣ Review & Edit Teams")
+    
+    cols = st.columns(num_teams)
+    for i in range(num_teams):
+        with cols[i]:
+            team_card(i)
+    
+    # Manual adjustment
+    st.markdown("---")
+    st.subheader("5️⃣ Manual Adjustments (Optional)")
+    
+    with st.expander("🔄 Move Players Between Teams"):
+        # A form, so picking the player and team doesn't rerun anything
+        with st.form("move_player", border=False):
+            col1, col2, col3 = st.columns(3)
+            
+            with col1:
+                all_team_players = []
+                for i, team in enumerate(teams):
+                    for player in team:
+                        all_team_players.append(f"{player['name']} (Team {i+1})")
+                
+                st.selectbox("Select Player", all_team_players, key="move_player")
+            
+            with col2:
+                st.selectbox("Move to Team", [f"Team {i+1}" for i in range(num_teams)], key="move_to_team")
+            
+            with col3:
+                st.write("")
+                st.write("")
+                st.form_submit_button("↔️ Move Player", on_click=move_clicked)
+        
+        if 'moved_player' in st.session_state:
+            st.success(f"✅ Moved {st.session_state.pop('moved_player')}")
+    
+    # Finalize teams
+    st.markdown("---")
+    if st.button("💾 Finalize Teams", type="primary"):
+        finalized_teams = []
+        for i in range(num_teams):
+            finalized_teams.append({
+                'name': st.session_state.get(f"team_name_{i}", f"Team {chr(65+i)}"),
+                'captain': st.session_state.get(f"captain_{i}") if teams[i] else None,
+                'players': [p['name'] for p in teams[i]],
+                'strength': st.session_state.team_strengths[i]
+            })
+        
+        st.session_state.finalized_teams = finalized_teams
+        st.session_state.finalized_game_id = game_id
+        
+        st.success("✅ Teams finalized! Go to Match Results to record the game.")
+        st.balloons()
+
+@st.fragment
+def player_rankings():
+    """Leaderboard for a chosen period; changing the period redraws only this"""
+    stats = st.session_state.stats
+    period = st.selectbox("Period", ["All time", "Season", "Month", "Last N matches", "Date range"])
+    window = None
+    if period == "Season":
+        seasons = stats.seasons()
+        if not seasons:
+            st.info("No dated matches yet")
+            return
+        window = stats.season(st.selectbox("Season", seasons))
+    elif period == "Month":
+        months = stats.months()
+        if not months:
+            st.info("No dated matches yet")
+            return
+        year, month = st.selectbox("Month", months, format_func=lambda m: date(m[0], m[1], 1).strftime('%B %Y'))
+        window = stats.month(year, month)
+    elif period == "Last N matches":
+        count = st.number_input("Matches", min_value=1, value=10)
+        window = stats.last_matches(count)
+    elif period == "Date range":
+        col1, col2 = st.columns(2)
+        with col1:
+            start = st.date_input("From", value=date.today().replace(day=1))
+        with col2:
+            end = st.date_input("To", value=date.today())
+        window = stats.match_range(start, end)
+    
+    if window is not None:
+        st.caption(f"Matches in this period: {window[1] - window[0]}")
+    df = stats.leaderboard(st.session_state.players, window)
+    # Learned from results, on the same scale as Rating
+    df['Skill'] = [round(st.session_state.ratings.get(name), 1) for name in df['Player']]
+    st.dataframe(df, use_container_width=True, hide_index=True)
 
 # ============================================================================
 # LOGIN PAGE
 # ============================================================================
 
 if not st.session_state.authenticated:
+    rerun_timer.section("page: Login")
+    require(PAGE_DATA["Login"])
+    watch_for_changes(PAGE_DATA["Login"])
     st.title("🏏 PK Expat Cricket League")
     st.markdown("---")
     
@@ -192,7 +452,7 @@ if not st.session_state.authenticated:
         st.subheader("Player Access")
         st.info("Select your name if you're a registered player")
         
-        player_names = [p['name'] for p in st.session_state.get('players', [])]
+        player_names = [p['name'] for p in st.session_state.players]
         if not player_names:
             st.warning("⚠️ No players registered yet. Contact admin.")
             player_names = []
@@ -230,10 +490,28 @@ else:
     st.markdown("---")
     
     # Navigation
-    if st.session_state.user_role in ["master_admin", "admin"]:
-        page = st.sidebar.radio("Navigate", ["Upcoming Games", "Players", "Team Generator", "Match Results", "Leaderboard"])
+    if st.session_state.user_role == "master_admin":
+        page = st.sidebar.radio("Navigate", ["Upcoming Games", "Players", "Team Generator", "Match Results", "Leaderboard", "Player Profile", "Diagnostics"])
+    elif st.session_state.user_role == "admin":
+        page = st.sidebar.radio("Navigate", ["Upcoming Games", "Players", "Team Generator", "Match Results", "Leaderboard", "Player Profile"])
     else:
-        page = st.sidebar.radio("Navigate", ["Upcoming Games", "Leaderboard"])
+        page = st.sidebar.radio("Navigate", ["Upcoming Games", "Leaderboard", "Player Profile"])
+    
+    # Saves are queued and sent in the background; show what hasn't landed yet
+    pending_writes, sync_error = store.sync_status()
+    if sync_error is not None and pending_writes:
+        st.sidebar.error(f"⚠️ Couldn't sync {pending_writes} change(s), retrying: {sync_error}")
+    elif sync_error is not None:
+        st.sidebar.error(f"⚠️ {sync_error}")
+    elif pending_writes:
+        st.sidebar.info(f"🔄 {pending_writes} change(s) waiting to sync")
+    if api_error is not None:
+        st.sidebar.warning(f"⚠️ JSON API not started on port {STORAGE_CONFIG['api_port']}: {api_error}")
+    
+    rerun_timer.section(f"page: {page}")
+    require(PAGE_DATA[page])
+    watch_for_changes(PAGE_DATA[page])
+    league = st.session_state.get('league')
     
     # ========================================================================
     # PAGE: UPCOMING GAMES
@@ -259,8 +537,10 @@ else:
                     max_players = st.number_input("Max Players", min_value=10, max_value=50, value=20)
                 
                 if st.form_submit_button("Create Game"):
+                    # Archived games keep their ids, so new ids start above them too
+                    require(['archive'])
                     game = {
-                        'id': len(st.session_state.games) + 1,
+                        'id': league.next_game_id(max([g['id'] for g in st.session_state.archive], default=0)),
                         'date': str(game_date),
                         'time': str(game_time),
                         'location': location,
@@ -269,62 +549,54 @@ else:
                         'votes': [],
                         'created_by': st.session_state.username
                     }
-                    st.session_state.games.append(game)
-                    save_games(st.session_state.games)
+                    save_games(league.with_game(game).games)
                     st.success(f"✅ Game created!")
                     st.rerun()
             
             st.markdown("---")
         
         # ALL USERS - View and vote
-        if st.session_state.games:
+        today = date.today().isoformat()
+        upcoming = league.upcoming(today)
+        if upcoming:
             st.subheader("🏏 Scheduled Games")
             
-            for game in st.session_state.games:
-                with st.expander(f"🏏 {game['date']} - {game['location']} ({game['type']})"):
-                    col1, col2, col3 = st.columns([2, 1, 1])
-                    
-                    with col1:
-                        st.write(f"**📍 Location:** {game['location']}")
-                        st.write(f"**🕐 Reporting Time:** {game['time']}")
-                        st.write(f"**👥 Capacity:** {len(game['votes'])}/{game['max_players']}")
-                    
-                    with col2:
-                        if game['votes']:
-                            st.write("**Players In:**")
-                            for player in game['votes']:
-                                st.write(f"✅ {player}")
-                        else:
-                            st.info("No votes yet")
-                    
-                    with col3:
-                        # PLAYER VOTING
-                        if st.session_state.user_role == "player":
-                            player_name = st.session_state.username
-                            
-                            if player_name in game['votes']:
-                                st.success("✅ You're in!")
-                                if st.button("❌ Cancel", key=f"cancel_{game['id']}"):
-                                    game['votes'].remove(player_name)
-                                    save_games(st.session_state.games)
-                                    st.rerun()
-                            else:
-                                if st.button("✅ I'm In!", key=f"join_{game['id']}"):
-                                    if len(game['votes']) < game['max_players']:
-                                        game['votes'].append(player_name)
-                                        save_games(st.session_state.games)
-                                        st.rerun()
-                                    else:
-                                        st.error("Game is full!")
-                        
-                        # ADMIN - Delete game
-                        if st.session_state.user_role in ["master_admin", "admin"]:
-                            if st.button("🗑️ Delete", key=f"delete_{game['id']}"):
-                                st.session_state.games = [g for g in st.session_state.games if g['id'] != game['id']]
-                                save_games(st.session_state.games)
-                                st.rerun()
+            page_count = (len(upcoming) - 1) // GAMES_PER_PAGE + 1
+            games_page = min(st.session_state.get('games_page', 1), page_count)
+            for game in upcoming[(games_page - 1) * GAMES_PER_PAGE:games_page * GAMES_PER_PAGE]:
+                game_card(game['id'])
+            
+            if page_count > 1:
+                col1, col2, col3 = st.columns([1, 2, 1])
+                with col1:
+                    if st.button("◀ Sooner", disabled=games_page == 1):
+                        st.session_state.games_page = games_page - 1
+                        st.rerun()
+                with col2:
+                    st.caption(f"Page {games_page} of {page_count} · {len(upcoming)} games")
+                with col3:
+                    if st.button("Later ▶", disabled=games_page == page_count):
+                        st.session_state.games_page = games_page + 1
+                        st.rerun()
         else:
             st.info("No games scheduled yet")
+        
+        # Past games live in the archive, fetched only when asked for
+        with st.expander("📦 Past Games"):
+            if st.button("Show past games") or 'archive' in st.session_state:
+                require(['archive'])
+                past = {g['id']: g for g in st.session_state.archive}
+                past.update({g['id']: g for g in league.past(today)})
+                if past:
+                    df = pd.DataFrame([{
+                        'Date': g['date'],
+                        'Location': g['location'],
+                        'Type': g['type'],
+                        'Players': len(g['votes'])
+                    } for g in sorted(past.values(), key=lambda g: str(g['date']), reverse=True)])
+                    st.dataframe(df, use_container_width=True, hide_index=True)
+                else:
+                    st.info("No past games yet")
     
     # ========================================================================
     # PAGE: PLAYERS
@@ -347,7 +619,7 @@ else:
                     
                     if st.form_submit_button("Add Player"):
                         if new_name:
-                            if any(p['name'].lower() == new_name.lower() for p in st.session_state.players):
+                            if league.has_player(new_name):
                                 st.error(f"❌ {new_name} already exists!")
                             else:
                                 player = {
@@ -358,8 +630,7 @@ else:
                                     'matches_won': 0,
                                     'points': 0
                                 }
-                                st.session_state.players.append(player)
-                                save_players(st.session_state.players)
+                                save_players(league.with_player(player).players)
                                 st.success(f"✅ {new_name} added!")
                                 st.rerun()
                         else:
@@ -372,7 +643,7 @@ else:
                     player_names_list = [p['name'] for p in st.session_state.players]
                     selected_player = st.selectbox("Select Player", player_names_list)
                     
-                    player_data = next(p for p in st.session_state.players if p['name'] == selected_player)
+                    player_data = league.player(selected_player)
                     
                     with st.form("edit_player"):
                         edit_rating = st.slider("Update Rating", 1, 10, player_data['rating'])
@@ -385,16 +656,15 @@ else:
                         col_a, col_b = st.columns(2)
                         with col_a:
                             if st.form_submit_button("💾 Update"):
-                                player_data['rating'] = edit_rating
-                                player_data['strength'] = edit_strength
-                                save_players(st.session_state.players)
+                                save_players(league.with_player_changed(
+                                    selected_player, rating=edit_rating, strength=edit_strength
+                                ).players)
                                 st.success(f"✅ {selected_player} updated!")
                                 st.rerun()
                         
                         with col_b:
                             if st.form_submit_button("🗑️ Delete"):
-                                st.session_state.players = [p for p in st.session_state.players if p['name'] != selected_player]
-                                save_players(st.session_state.players)
+                                save_players(league.without_player(selected_player).players)
                                 st.success(f"🗑️ {selected_player} deleted!")
                                 st.rerun()
                 else:
@@ -404,16 +674,16 @@ else:
             st.markdown("---")
             st.subheader("📋 All Players")
             if st.session_state.players:
-                df_data = [{
-                    'Name': p['name'],
-                    'Rating': p['rating'],
-                    'Strength': p['strength'],
-                    'Matches': p['matches_played'],
-                    'Wins': p['matches_won'],
-                    'Points': p['points']
-                } for p in st.session_state.players]
-                
-                df = pd.DataFrame(df_data)
+                player_stats = st.session_state.stats.player_stats(st.session_state.players)
+                df = pd.DataFrame({
+                    'Name': player_stats.index,
+                    'Rating': player_stats['rating'].to_numpy(),
+                    'Strength': player_stats['strength'].to_numpy(),
+                    'Matches': player_stats['matches_played'].to_numpy(),
+                    'Wins': player_stats['matches_won'].to_numpy(),
+                    'Points': player_stats['points'].to_numpy(),
+                    'Skill': [round(st.session_state.ratings.get(name), 1) for name in player_stats.index]
+                })
                 st.dataframe(df, use_container_width=True, hide_index=True)
             else:
                 st.info("No players yet")
@@ -456,30 +726,19 @@ else:
                 
                 # STEP 3: Generate teams
                 st.subheader("3️⃣ Generate Balanced Teams")
+                st.caption("Balanced on ratings learned from match results, starting from each player's set rating")
                 
                 if st.button("🎲 Generate Teams", type="primary"):
-                    voting_players = [p for p in st.session_state.players if p['name'] in selected_game['votes']]
+                    voting_players = st.session_state.ratings.rated(league.voters(selected_game['id']))
                     
                     if len(voting_players) < num_teams:
                         st.error(f"Need at least {num_teams} players! Only {len(voting_players)} voted.")
                     else:
-                        sorted_players = sorted(voting_players, key=lambda x: x['rating'], reverse=True)
-                        
-                        teams = [[] for _ in range(num_teams)]
-                        team_strengths = [0] * num_teams
-                        
-                        for i, player in enumerate(sorted_players):
-                            round_num = i // num_teams
-                            if round_num % 2 == 0:
-                                team_idx = i % num_teams
-                            else:
-                                team_idx = num_teams - 1 - (i % num_teams)
-                            
-                            teams[team_idx].append(player)
-                            team_strengths[team_idx] += player['rating']
-                        
-                        st.session_state.generated_teams = teams
-                        st.session_state.team_strengths = team_strengths
+                        # Equal sizes, roles spread out, small rating gap, few repeated teammates
+                        pairings = pairing_counts(st.session_state.matches, [p['name'] for p in voting_players])
+                        st.session_state.team_options = team_options(voting_players, num_teams, pairings)
+                        st.session_state.team_option = 0
+                        option_picked()
                         st.session_state.selected_game_id = selected_game['id']
                         
                         st.success("✅ Teams generated!")
@@ -487,98 +746,18 @@ else:
                 
                 # STEP 4: Display and edit teams
                 if 'generated_teams' in st.session_state and st.session_state.get('selected_game_id') == selected_game['id']:
-                    st.markdown("---")
-                    st.subheader("4️⃣ Review & Edit Teams")
-                    
-                    teams = st.session_state.generated_teams
-                    
-                    team_names = []
-                    team_captains = []
-                    
-                    cols = st.columns(num_teams)
-                    
-                    for i in range(num_teams):
-                        with cols[i]:
-                            st.markdown(f"### Team {i+1}")
-                            
-                            team_name = st.text_input(f"Team Name", value=f"Team {chr(65+i)}", key=f"team_name_{i}")
-                            team_names.append(team_name)
-                            
-                            st.metric("Total Strength", st.session_state.team_strengths[i])
-                            
-                            if teams[i]:
-                                captain = st.selectbox(
-                                    "Captain",
-                                    [p['name'] for p in teams[i]],
-                                    key=f"captain_{i}"
-                                )
-                                team_captains.append(captain)
-                                
-                                st.write("**Players:**")
-                                for player in teams[i]:
-                                    if player['name'] == captain:
-                                        st.write(f"⭐ **{player['name']}** (C) - {player['strength']} (Rating: {player['rating']})")
-                                    else:
-                                        st.write(f"• {player['name']} - {player['strength']} (Rating: {player['rating']})")
-                            else:
-                                st.warning("No players in this team")
-                    
-                    # Manual adjustment
-                    st.markdown("---")
-                    st.subheader("5️⃣ Manual Adjustments (Optional)")
-                    
-                    with st.expander("🔄 Move Players Between Teams"):
-                        col1, col2, col3 = st.columns(3)
-                        
-                        with col1:
-                            all_team_players = []
-                            for i, team in enumerate(teams):
-                                for player in team:
-                                    all_team_players.append(f"{player['name']} (Team {i+1})")
-                            
-                            if all_team_players:
-                                player_to_move = st.selectbox("Select Player", all_team_players)
-                        
-                        with col2:
-                            dest_team = st.selectbox("Move to Team", [f"Team {i+1}" for i in range(num_teams)])
-                        
-                        with col3:
-                            st.write("")
-                            st.write("")
-                            if st.button("↔️ Move Player"):
-                                player_name = player_to_move.split(" (Team")[0]
-                                current_team_idx = int(player_to_move.split("Team ")[1].rstrip(")")) - 1
-                                dest_team_idx = int(dest_team.split(" ")[1]) - 1
-                                
-                                for player in teams[current_team_idx]:
-                                    if player['name'] == player_name:
-                                        teams[current_team_idx].remove(player)
-                                        teams[dest_team_idx].append(player)
-                                        
-                                        st.session_state.team_strengths[current_team_idx] -= player['rating']
-                                        st.session_state.team_strengths[dest_team_idx] += player['rating']
-                                        
-                                        st.success(f"✅ Moved {player_name}")
-                                        st.rerun()
-                                        break
-                    
-                    # Finalize teams
-                    st.markdown("---")
-                    if st.button("💾 Finalize Teams", type="primary"):
-                        finalized_teams = []
-                        for i in range(num_teams):
-                            finalized_teams.append({
-                                'name': team_names[i],
-                                'captain': team_captains[i] if i < len(team_captains) else None,
-                                'players': [p['name'] for p in teams[i]],
-                                'strength': st.session_state.team_strengths[i]
-                            })
-                        
-                        st.session_state.finalized_teams = finalized_teams
-                        st.session_state.finalized_game_id = selected_game['id']
-                        
-                        st.success("✅ Teams finalized! Go to Match Results to record the game.")
-                        st.balloons()
+                    options = st.session_state.get('team_options', [])
+                    if len(options) > 1:
+                        st.radio(
+                            "Pick a split",
+                            range(len(options)),
+                            format_func=lambda i: f"Option {i+1}: strength gap {options[i]['spread']:g}, "
+                                                  f"{options[i]['repeats']:.1f} repeat pairings",
+                            key="team_option",
+                            on_change=option_picked,
+                            horizontal=True
+                        )
+                    team_review(num_teams, selected_game['id'])
         
         else:
             st.warning("⚠️ Admin access required")
@@ -634,25 +813,10 @@ else:
                         'num_teams': num_teams
                     }
                     
-                    st.session_state.matches.append(match_record)
-                    save_matches(st.session_state.matches)
-                    
-                    # Update player stats
-                    winning_team = next(team for team in finalized_teams if team['name'] == winner)
-                    winning_players = winning_team['players']
-                    
-                    all_playing_players = []
-                    for team in finalized_teams:
-                        all_playing_players.extend(team['players'])
-                    
-                    for player in st.session_state.players:
-                        if player['name'] in all_playing_players:
-                            player['matches_played'] += 1
-                            if player['name'] in winning_players:
-                                player['matches_won'] += 1
-                                player['points'] += 1
+                    record_match(match_record)
                     
-                    save_players(st.session_state.players)
+                    # Update player stats from the match history
+                    save_players(st.session_state.stats.with_counters(st.session_state.players))
                     
                     st.success(f"✅ Match recorded! {winner} wins! 🏆")
                     st.balloons()
@@ -662,6 +826,7 @@ else:
                     del st.session_state.finalized_game_id
                     if 'generated_teams' in st.session_state:
                         del st.session_state.generated_teams
+                    st.session_state.pop('team_options', None)
                     
                     st.info("Teams cleared. Generate new teams for next match.")
                 
@@ -681,6 +846,40 @@ else:
                                     st.write(f"**{team['name']}** (Captain: {team['captain']})")
                                 st.write(f"Players: {', '.join(team['players'])}")
                                 st.write("")
+            
+            # Corrections are rare: each rewrites that match's rows, not the history
+            if st.session_state.matches:
+                st.markdown("---")
+                st.subheader("✏️ Correct a Match")
+                
+                recent = list(reversed(st.session_state.matches[-CORRECTABLE_MATCHES:]))
+                match_idx = st.selectbox(
+                    "Recorded match",
+                    range(len(recent)),
+                    format_func=lambda i: f"Match {recent[i]['id']} - {recent[i]['date']} - Winner: {recent[i]['winner']}",
+                    key="correct_match"
+                )
+                match = recent[match_idx]
+                team_names = [team['name'] for team in match['teams']]
+                corrected_winner = st.selectbox(
+                    "Winning team",
+                    team_names,
+                    index=team_names.index(match['winner']) if match['winner'] in team_names else 0,
+                    key=f"correct_winner_{match['id']}"
+                )
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("💾 Save Correction", disabled=corrected_winner == match['winner']):
+                        update_match(dict(match, winner=corrected_winner))
+                        save_players(st.session_state.stats.with_counters(st.session_state.players))
+                        st.success(f"✅ Match {match['id']} updated: {corrected_winner} wins")
+                with col2:
+                    confirm = st.checkbox("Yes, delete this match", key=f"confirm_delete_{match['id']}")
+                    if st.button("🗑️ Delete Match", disabled=not confirm):
+                        delete_match(match['id'])
+                        save_players(st.session_state.stats.with_counters(st.session_state.players))
+                        st.success(f"✅ Match {match['id']} deleted")
         
         else:
             st.warning("⚠️ Admin access required")
@@ -721,21 +920,103 @@ else:
                 st.info("No players registered yet")
             else:
                 st.subheader("👤 Player Rankings")
-                
-                leaderboard = sorted(st.session_state.players, key=lambda x: x['points'], reverse=True)
-                
-                lb_data = []
-                for i, player in enumerate(leaderboard, 1):
-                    win_rate = (player['matches_won'] / player['matches_played'] * 100) if player['matches_played'] > 0 else 0
-                    lb_data.append({
-                        'Rank': f"#{i}",
-                        'Player': player['name'],
-                        'Points': player['points'],
-                        'Matches': player['matches_played'],
-                        'Wins': player['matches_won'],
-                        'Win Rate': f"{win_rate:.1f}%",
-                        'Rating': player['rating']
-                    })
-                
-                df = pd.DataFrame(lb_data)
+                player_rankings()
+    
+    # ========================================================================
+    # PAGE: PLAYER PROFILE
+    # ========================================================================
+    
+    elif page == "Player Profile":
+        st.header("👤 Player Profile")
+        
+        player_names = [p['name'] for p in st.session_state.players]
+        if not player_names:
+            st.info("No players registered yet")
+        else:
+            own = player_names.index(st.session_state.username) if st.session_state.username in player_names else 0
+            name = st.selectbox("Player", player_names, index=own)
+            player = league.player(name)
+            
+            totals = st.session_state.stats.player_stats([player]).iloc[0]
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Matches", int(totals['matches_played']))
+            col2.metric("Wins", int(totals['matches_won']))
+            col3.metric("Win Rate", f"{totals['win_rate']:.1f}%")
+            col4.metric("Skill", f"{st.session_state.ratings.get(name):.1f}", help=f"Set rating: {player['rating']}")
+            
+            # Shared by every session, moved on match by match as results come in
+            pairs = store.derived('pairs', PairStats, st.session_state.matches, update=PairStats.updated)
+            min_games = st.slider("Minimum games together / against", 1, 10, 2)
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.subheader("🤝 Best Partners")
+                partners = pairs.partners(name, min_games)
+                if partners.empty:
+                    st.info("Not enough games yet")
+                else:
+                    st.dataframe(partners, use_container_width=True, hide_index=True)
+            with col2:
+                st.subheader("⚔️ Toughest Rivals")
+                rivals = pairs.rivals(name, min_games)
+                if rivals.empty:
+                    st.info("Not enough games yet")
+                else:
+                    st.dataframe(rivals, use_container_width=True, hide_index=True)
+            
+            st.subheader("🔍 Head to Head")
+            other = st.selectbox("Compare with", [n for n in player_names if n != name])
+            if other:
+                games_with, wins_with = pairs.together(name, other)
+                games_vs, wins_vs = pairs.against(name, other)
+                col1, col2 = st.columns(2)
+                col1.metric("Together", f"{wins_with}/{games_with} won")
+                col2.metric(f"Against {other}", f"{wins_vs}/{games_vs} won")
+    
+    # ========================================================================
+    # PAGE: DIAGNOSTICS
+    # ========================================================================
+    
+    elif page == "Diagnostics":
+        st.header("🩺 Diagnostics")
+        
+        if st.session_state.user_role == "master_admin":
+            
+            # Sheets quota
+            st.subheader("📈 Google Sheets Quota (last 60s)")
+            reads, writes = PROFILER.quota_usage()
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Read requests", f"{reads}/{QUOTA_PER_MINUTE}")
+                st.progress(min(reads / QUOTA_PER_MINUTE, 1.0))
+            with col2:
+                st.metric("Write requests", f"{writes}/{QUOTA_PER_MINUTE}")
+                st.progress(min(writes / QUOTA_PER_MINUTE, 1.0))
+            
+            st.markdown("---")
+            
+            # Slowest operations
+            st.subheader("🐢 Slowest Operations")
+            summary = PROFILER.summary()
+            if summary:
+                df = pd.DataFrame(summary).round(1)
+                st.dataframe(df, use_container_width=True, hide_index=True)
+            else:
+                st.info("Nothing recorded yet")
+            
+            # This session's previous run
+            last_rerun = st.session_state.get('_last_rerun')
+            if last_rerun is not None:
+                st.subheader("⏱️ Your Last Rerun")
+                st.write(f"**Total:** {last_rerun.total * 1000:.1f} ms")
+                df = pd.DataFrame([{'Section': name, 'ms': round(seconds * 1000, 1)} for name, seconds in last_rerun.sections])
                 st.dataframe(df, use_container_width=True, hide_index=True)
+            
+            if st.button("🔄 Reset Counters"):
+                PROFILER.reset()
+                st.rerun()
+        
+        else:
+            st.warning("⚠️ Master admin access required")
+
+end_rerun(st.session_state)
@@ -0,0 +1,206 @@
+"""In-process profiling of storage calls, Sheets API requests and page sections.
+
+:data:`PROFILER` is shared by every session in the process.  It keeps, per
+operation, a call count, bytes transferred and a rolling window of latencies
+for p50/p95, plus timestamps of recent Sheets requests so the Diagnostics page
+can show how close the app is to the per-minute quota.
+
+Each rerun gets a :class:`RerunTimer` (kept in the session state) that times
+the page sections one after another and records the rerun total.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+# Latencies kept per operation for the percentiles
+WINDOW = 500
+
+# Google Sheets allows about 60 read and 60 write requests per minute per user
+QUOTA_PER_MINUTE = 60
+
+# drive_version goes to the Drive API, but is throttled and counted as a read to be safe;
+# open_by_key fetches the spreadsheet's metadata
+READ_METHODS = {
+    'get_all_values', 'get_all_records', 'row_values', 'batch_get', 'get', 'fetch_sheet_metadata', 'drive_version',
+    'open_by_key'
+}
+
+
+def payload_size(value):
+    """Rough JSON size of a request or response, in bytes"""
+    if value is None:
+        return 0
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[int(round(q * (len(sorted_values) - 1)))]
+
+
+class OpStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.bytes = 0
+        self.latencies = deque(maxlen=WINDOW)
+
+
+class Profiler:
+    """Counts, latencies and bytes per operation name"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = {}
+        self.sheets_reads = deque()
+        self.sheets_writes = deque()
+
+    def record(self, op, seconds, nbytes=0, error=False):
+        with self.lock:
+            stats = self.ops.setdefault(op, OpStats())
+            stats.count += 1
+            stats.errors += int(error)
+            stats.total += seconds
+            stats.bytes += nbytes
+            stats.latencies.append(seconds)
+
+    def record_sheets_request(self, method, seconds, nbytes=0, error=False):
+        """One HTTP request to the Sheets API, also counted against the quota"""
+        self.record(f"sheets.{method}", seconds, nbytes, error)
+        with self.lock:
+            (self.sheets_reads if method in READ_METHODS else self.sheets_writes).append(time.time())
+
+    def timed(self, op):
+        return _Timed(self, op)
+
+    def quota_usage(self, window=60):
+        """(reads, writes) sent to Sheets in the last ``window`` seconds"""
+        cutoff = time.time() - window
+        with self.lock:
+            for requests in (self.sheets_reads, self.sheets_writes):
+                while requests and requests[0] < cutoff:
+                    requests.popleft()
+            return len(self.sheets_reads), len(self.sheets_writes)
+
+    def summary(self):
+        """One dict per operation, slowest p95 first"""
+        rows = []
+        with self.lock:
+            for op, stats in self.ops.items():
+                latencies = sorted(stats.latencies)
+                rows.append({
+                    'operation': op,
+                    'calls': stats.count,
+                    'errors': stats.errors,
+                    'p50 ms': percentile(latencies, 0.5) * 1000,
+                    'p95 ms': percentile(latencies, 0.95) * 1000,
+                    'max ms': (latencies[-1] if latencies else 0) * 1000,
+                    'total s': stats.total,
+                    'KB': stats.bytes / 1024
+                })
+        return sorted(rows, key=lambda r: r['p95 ms'], reverse=True)
+
+    def reset(self):
+        with self.lock:
+            self.ops = {}
+            self.sheets_reads.clear()
+            self.sheets_writes.clear()
+
+
+class _Timed:
+    def __init__(self, profiler, op):
+        self.profiler = profiler
+        self.op = op
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.record(self.op, time.perf_counter() - self.start, error=exc_type is not None)
+
+
+PROFILER = Profiler()
+
+# ============================================================================
+# STORAGE WRAPPER
+# ============================================================================
+
+class ProfiledStorage:
+    """Times every call made on a storage object as ``storage.<method>``"""
+
+    def __init__(self, store, profiler=PROFILER):
+        self.store = store
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        attr = getattr(self.store, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self.profiler.timed(f"storage.{name}"):
+                return attr(*args, **kwargs)
+
+        return call
+
+# ============================================================================
+# RERUN TIMING
+# ============================================================================
+
+class RerunTimer:
+    """Times consecutive sections of one script run.
+
+    A run cut short by ``st.rerun()`` or a new widget event never reaches
+    :meth:`finish`; the next run's :func:`begin_rerun` closes it instead.
+    """
+
+    def __init__(self, profiler=PROFILER):
+        self.profiler = profiler
+        self.start = time.perf_counter()
+        self.sections = []
+        self.current = None
+        self.finished = False
+
+    def section(self, name):
+        """End the running section, if any, and start ``name``"""
+        now = time.perf_counter()
+        if self.current is not None:
+            label, started = self.current
+            self.sections.append((label, now - started))
+            self.profiler.record(f"section.{label}", now - started)
+        self.current = (name, now)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.section(None)
+        self.current = None
+        self.finished = True
+        self.total = time.perf_counter() - self.start
+        self.profiler.record("rerun", self.total)
+
+
+def begin_rerun(state, profiler=PROFILER):
+    """Start timing this run; ``state`` is the session state"""
+    previous = state.get('_rerun_timer')
+    if previous is not None and not previous.finished:
+        previous.finish()
+        state['_last_rerun'] = previous
+    timer = RerunTimer(profiler)
+    state['_rerun_timer'] = timer
+    return timer
+
+
+def end_rerun(state):
+    timer = state.get('_rerun_timer')
+    if timer is not None:
+        timer.finish()
+        state['_last_rerun'] = timer
@@ -0,0 +1,166 @@
+"""In-process stand-in for the parts of gspread the app uses.
+
+Used by the benchmarks (and handy for offline experiments): a
+:class:`FakeSpreadsheet` behaves like a gspread Spreadsheet whose worksheets
+keep their cells in memory.  Every method that would be an HTTP request is
+counted, optionally sleeps to simulate latency, and adds the JSON size of its
+payload to a byte counter, so API call regressions show up without a network.
+"""
+
+import itertools
+import json
+import time
+from collections import Counter
+
+from gspread.utils import a1_to_rowcol
+
+_ids = itertools.count(1)
+
+READS = {'get_all_values', 'get_all_records', 'row_values', 'batch_get', 'drive_version'}
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    return str(value)
+
+
+class FakeSpreadsheet:
+    """A spreadsheet whose worksheets are created on first access"""
+
+    def __init__(self, latency=0.0):
+        self.id = f"fake-{next(_ids)}"
+        self.latency = latency
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.worksheets = {}
+        self.version = 1
+
+    def _request(self, name, sent=None, received=None):
+        self.calls[name] += 1
+        if name not in READS:
+            self.version += 1
+        if sent is not None:
+            self.bytes_sent += len(json.dumps(sent, default=str))
+        if received is not None:
+            self.bytes_received += len(json.dumps(received))
+        if self.latency:
+            time.sleep(self.latency)
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset_counters(self):
+        self.calls.clear()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def worksheet(self, title):
+        if title not in self.worksheets:
+            self.worksheets[title] = FakeWorksheet(self, len(self.worksheets), title)
+        return self.worksheets[title]
+
+    def revision(self):
+        """Like :meth:`sheets_client.SheetsConnection.revision`: bumped by every write"""
+        self._request('drive_version')
+        return self.version
+
+    def values_batch_get(self, ranges):
+        """Whole-worksheet ranges only, e.g. ``"'Players'"``"""
+        missing = [r for r in ranges if r.strip("'") not in self.worksheets]
+        if missing:
+            # Like the API: a range naming a tab that doesn't exist fails the whole request
+            self._request('batch_get', sent=ranges)
+            raise ValueError(f"Unable to parse range: {missing[0]}")
+        value_ranges = [{'range': r, 'values': self.worksheets[r.strip("'")]._values()} for r in ranges]
+        self._request('batch_get', sent=ranges, received=value_ranges)
+        return {'spreadsheetId': self.id, 'valueRanges': value_ranges}
+
+
+class FakeWorksheet:
+    """Cells as a list of rows of strings, like the API returns them"""
+
+    def __init__(self, spreadsheet, sheet_id, title, rows=1000, cols=26):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.rows = []
+
+    # ------------------------------------------------------------------
+    # Helpers
+    # ------------------------------------------------------------------
+
+    def _values(self):
+        rows = [list(r) for r in self.rows]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        width = max([len(r) for r in rows] or [0])
+        return [r + [''] * (width - len(r)) for r in rows]
+
+    def _put(self, top_left, values):
+        row0, col0 = a1_to_rowcol(top_left.split(':')[0])
+        for i, row in enumerate(values):
+            r = row0 - 1 + i
+            while len(self.rows) <= r:
+                self.rows.append([])
+            cells = self.rows[r]
+            for j, value in enumerate(row):
+                c = col0 - 1 + j
+                while len(cells) <= c:
+                    cells.append('')
+                cells[c] = _cell(value)
+            self.row_count = max(self.row_count, len(self.rows))
+
+    # ------------------------------------------------------------------
+    # gspread Worksheet methods
+    # ------------------------------------------------------------------
+
+    def get_all_values(self):
+        values = self._values()
+        self.spreadsheet._request('get_all_values', received=values)
+        return values
+
+    def get_all_records(self):
+        values = self._values()
+        self.spreadsheet._request('get_all_records', received=values)
+        if not values:
+            return []
+        return [dict(zip(values[0], row)) for row in values[1:]]
+
+    def row_values(self, row):
+        values = self._values()
+        result = values[row - 1] if len(values) >= row else []
+        self.spreadsheet._request('row_values', received=result)
+        return result
+
+    def update(self, values=None, range_name=None, value_input_option=None):
+        self.spreadsheet._request('update', sent=values)
+        self._put(range_name or 'A1', values)
+
+    def batch_update(self, data, value_input_option=None):
+        self.spreadsheet._request('batch_update', sent=data)
+        for d in data:
+            self._put(d['range'], d['values'])
+
+    def append_row(self, values, value_input_option=None):
+        self.spreadsheet._request('append_row', sent=values)
+        self._put(f"A{len(self._values()) + 1}", [values])
+
+    def append_rows(self, values, value_input_option=None, table_range=None):
+        self.spreadsheet._request('append_rows', sent=values)
+        self._put(f"A{len(self._values()) + 1}", values)
+
+    def clear(self):
+        self.spreadsheet._request('clear')
+        self.rows = []
+
+    def add_rows(self, rows):
+        self.spreadsheet._request('add_rows')
+        self.row_count += rows
+
+    def add_cols(self, cols):
+        self.spreadsheet._request('add_cols')
+        self.col_count += cols
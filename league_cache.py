@@ -0,0 +1,362 @@
+"""Process-wide read cache in front of a storage backend.
+
+Every browser session used to fetch players, games and matches on its own.
+:class:`CachedStorage` keeps one copy of each dataset for the whole process,
+refetches it once the TTL runs out, and replaces it whenever a save goes
+through it, so sessions read an in-memory snapshot instead of Google.
+
+Cached data is never changed in place: an edit builds new lists that reuse the
+untouched dicts and swaps the entry.  That lets :meth:`CachedStorage.load_shared`
+hand every session the same objects, and :meth:`CachedStorage.derived` share
+what is built from them (the League indexes, the stats), instead of each
+session holding its own deep copy.  Recording a match keeps every earlier
+match object and anything else that changes the history hands out new ones,
+so derived data can tell an append from an edit by the last match it saw
+(see :func:`league_model.appended_since`).
+
+Backends that track per-dataset versions (see :meth:`storage.Storage.versions`)
+are polled at most every ``VERSION_POLL`` seconds; a dataset another process
+changed is refetched on the next read instead of waiting out the TTL.  The
+tokens this process's own writes set are taken on as they are written, so
+those don't look like remote changes.
+"""
+
+import copy
+import threading
+import time
+
+import numpy as np
+
+from storage import APPEARANCE_COLUMNS, Storage, appearance_rows, apply_vote, next_match_id, rows_to_columns
+
+DATASETS = ['players', 'games', 'archive', 'matches']
+
+# Seconds between version checks, shared by every session in the process
+VERSION_POLL = 15
+
+# Builds kept per derived() key: sessions still on the previous snapshot
+# shouldn't force a rebuild on every rerun until they catch up
+DERIVED_KEEP = 2
+
+
+def _appearance_columns(matches):
+    rows = [row for m in matches for row in appearance_rows(m)]
+    return rows_to_columns(rows, APPEARANCE_COLUMNS)
+
+
+def _extended(column, values):
+    """``column`` with ``values`` after it, without copying what's there.
+
+    Columns become views of object arrays with room to spare.  Appending
+    writes past the end of the view, where no earlier view can see, and only
+    copies once the buffer is full.  Safe because only the current cache
+    entry is ever extended, under its lock.
+    """
+    n, k = len(column), len(values)
+    buffer = column.base if isinstance(column, np.ndarray) else None
+    if buffer is None or len(buffer) < n + k:
+        buffer = np.empty(max(2 * (n + k), 64), dtype=object)
+        buffer[:n] = column
+    buffer[n:n + k] = values
+    return buffer[:n + k]
+
+
+class CachedStorage(Storage):
+    """Wraps a :class:`storage.Storage` with a shared TTL cache"""
+
+    def __init__(self, store, ttl=60):
+        self.store = store
+        self.ttl = ttl
+        self.entries = {}
+        self.locks = {name: threading.Lock() for name in DATASETS}
+        self.loaded_versions = {}
+        self.remote_versions = None
+        self.polled = None
+        self.version_lock = threading.Lock()
+        self.builds = {}
+        self.build_lock = threading.Lock()
+        # Lowest id a new match may take: ids of matches deleted here aren't reused
+        self.next_match_id = 1
+        # Writes queued below report their tokens once they are sent
+        store.watch_versions(self._written)
+
+    # ------------------------------------------------------------------
+    # Cache plumbing
+    # ------------------------------------------------------------------
+
+    def versions(self):
+        """The backend's dataset versions, asked for at most every VERSION_POLL seconds"""
+        with self.version_lock:
+            now = time.monotonic()
+            if self.polled is None or now - self.polled > VERSION_POLL:
+                self.polled = now
+                try:
+                    self.remote_versions = self.store.versions()
+                except Exception:
+                    # Already counted as a failed request; keep serving the last
+                    # known versions and let the TTL cover the gap
+                    pass
+            return self.remote_versions
+
+    def _written(self, tokens):
+        """Take on the version tokens set by a write that went through this cache.
+
+        The cached copy already has the write in it, so only a copy that was
+        current before the write is marked current after it.
+        """
+        if not tokens:
+            return
+        with self.version_lock:
+            remote = self.remote_versions
+            if remote is None:
+                return
+            for name, token in tokens.items():
+                if self.loaded_versions.get(name) == remote.get(name):
+                    self.loaded_versions[name] = token
+            self.remote_versions = dict(remote, **tokens)
+
+    def _stale(self, name, versions):
+        entry = self.entries.get(name)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return True
+        return versions is not None and versions.get(name) != self.loaded_versions.get(name)
+
+    def _get(self, name, load, pick=copy.deepcopy):
+        # Holding the lock while loading lets concurrent sessions share one fetch
+        with self.locks[name]:
+            # Versions from before the load: a write landing during it gets refetched
+            versions = self.versions()
+            if self._stale(name, versions):
+                self._loaded(name, load(), versions)
+            # Sessions mutate what they get back, so never hand out the cached copy
+            return pick(self.entries[name][1])
+
+    def _loaded(self, name, data, versions=None):
+        entry = self.entries[name] = (time.monotonic(), data)
+        self.loaded_versions[name] = versions.get(name) if versions else None
+        return entry
+
+    def _put(self, name, save, data):
+        # What was saved becomes the shared copy: callers must not change it afterwards
+        with self.locks[name]:
+            try:
+                tokens = save(data)
+            except Exception:
+                self.entries.pop(name, None)
+                raise
+            self.entries[name] = (time.monotonic(), data)
+            self._written(tokens)
+
+    def _edit(self, name, write, change):
+        """Write through, then swap the cached value for ``change(value)`` if there is one"""
+        with self.locks[name]:
+            try:
+                tokens = write()
+            except Exception:
+                self.entries.pop(name, None)
+                raise
+            entry = self.entries.get(name)
+            if entry is not None:
+                self.entries[name] = (entry[0], change(entry[1]))
+            self._written(tokens)
+
+    def load_many(self, names):
+        """Serve ``names`` from the cache, fetching every stale one in one go"""
+        shared = self.load_shared(names)
+        return {name: copy.deepcopy(value) for name, value in shared.items()}
+
+    def load_shared(self, names):
+        """Like :meth:`load_many` but without copying: the data is shared, never change it"""
+        names = list(names)
+        locks = [self.locks[name] for name in DATASETS if name in names]
+        for lock in locks:
+            lock.acquire()
+        try:
+            versions = self.versions()
+            stale = [name for name in names if self._stale(name, versions)]
+            if stale:
+                for name, data in self.store.load_many(stale).items():
+                    self._loaded(name, data, versions)
+            return {name: self.entries[name][1] for name in names}
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def derived(self, key, build, *sources, update=None):
+        """``build(*sources)``, built once and shared for as long as ``sources`` are the same objects.
+
+        ``update(previous, *sources)``, if given, may derive the value from the
+        latest earlier build more cheaply; it returns None when it can't.
+        """
+        with self.build_lock:
+            kept = self.builds.setdefault(key, [])
+            for built_from, value in kept:
+                if len(built_from) == len(sources) and all(a is b for a, b in zip(built_from, sources)):
+                    return value
+            value = update(kept[0][1], *sources) if update is not None and kept else None
+            if value is None:
+                value = build(*sources)
+            kept.insert(0, (sources, value))
+            del kept[DERIVED_KEEP:]
+            return value
+
+    def invalidate(self, name=None):
+        """Forget one dataset, or all of them, so the next read refetches"""
+        for key in ([name] if name else DATASETS):
+            with self.locks[key]:
+                self.entries.pop(key, None)
+
+    # ------------------------------------------------------------------
+    # Storage interface
+    # ------------------------------------------------------------------
+
+    def load_players(self):
+        return self._get('players', self.store.load_players)
+
+    def save_players(self, players):
+        self._put('players', self.store.save_players, players)
+
+    def load_games(self):
+        return self._get('games', self.store.load_games)
+
+    def save_games(self, games):
+        # The session's votes may be stale and the vote log is what counts,
+        # so keep the votes already cached rather than the ones saved
+        with self.locks['games']:
+            try:
+                tokens = self.store.save_games(games)
+            except Exception:
+                self.entries.pop('games', None)
+                raise
+            entry = self.entries.get('games')
+            if entry is not None:
+                votes = {g['id']: g['votes'] for g in entry[1]}
+                games = [dict(g, votes=votes[g['id']]) if g['id'] in votes else g for g in games]
+                self.entries['games'] = (entry[0], games)
+            self._written(tokens)
+        # Saving moves past games to the archive; a backend reporting versions
+        # says whether it did, others may have
+        if not tokens or 'archive' in tokens:
+            with self.locks['archive']:
+                self.entries.pop('archive', None)
+
+    def load_archive(self):
+        return self._get('archive', self.store.load_archive)
+
+    def cast_vote(self, game_id, player, action):
+        if self.store.atomic_votes:
+            return self._cast_vote_atomic(game_id, player, action)
+        # Checked against the shared copy under the lock, so two sessions in
+        # this process can't both take the last place
+        with self.locks['games']:
+            versions = self.versions()
+            if self._stale('games', versions):
+                self._loaded('games', self.store.load_games(), versions)
+            entry = self.entries['games']
+            game = next((g for g in entry[1] if g['id'] == game_id), None)
+            if game is None:
+                return False, []
+            trial = dict(game, votes=list(game['votes']))
+            changed = apply_vote(trial, player, action)
+            if changed:
+                try:
+                    tokens = self.store.append_vote(game_id, player, action)
+                except Exception:
+                    self.entries.pop('games', None)
+                    raise
+                self.entries['games'] = (entry[0], [trial if g is game else g for g in entry[1]])
+                self._written(tokens)
+            return changed, list(trial['votes'])
+
+    def _cast_vote_atomic(self, game_id, player, action):
+        # The backend's own check covers other processes too; the cache just
+        # takes on the votes it settled on
+        with self.locks['games']:
+            try:
+                changed, votes = self.store.cast_vote(game_id, player, action)
+            except Exception:
+                self.entries.pop('games', None)
+                raise
+            entry = self.entries.get('games')
+            if entry is not None:
+                games = [dict(g, votes=list(votes)) if g['id'] == game_id else g for g in entry[1]]
+                self.entries['games'] = (entry[0], games)
+            return changed, list(votes)
+
+    def clear_votes(self, game_id):
+        def change(games):
+            return [dict(g, votes=[]) if g['id'] == game_id else g for g in games]
+
+        self._edit('games', lambda: self.store.clear_votes(game_id), change)
+
+    # The 'matches' entry holds (matches, appearance columns) from load_history
+
+    def load_history(self):
+        return self._get('matches', self.store.load_history)
+
+    def load_matches(self):
+        return self._get('matches', self.store.load_history, lambda h: copy.deepcopy(h[0]))
+
+    def load_appearances(self):
+        # Columns hold plain values, so copying the lists is enough
+        return self._get('matches', self.store.load_history, lambda h: {c: list(v) for c, v in h[1].items()})
+
+    def save_matches(self, matches):
+        with self.locks['matches']:
+            try:
+                tokens = self.store.save_matches(matches)
+            except Exception:
+                self.entries.pop('matches', None)
+                raise
+            matches = [dict(m) for m in matches]
+            history = (matches, _appearance_columns(matches))
+            self.entries['matches'] = (time.monotonic(), history)
+            self._written(tokens)
+
+    def append_match(self, match):
+        """Record ``match`` under the next free id and return it as stored.
+
+        The id is taken here, under the lock and from the latest history, so
+        two sessions recording at once can't give their matches the same one.
+        """
+        with self.locks['matches']:
+            versions = self.versions()
+            if self._stale('matches', versions):
+                self._loaded('matches', self.store.load_history(), versions)
+            entry = self.entries['matches']
+            match = dict(match, id=max(next_match_id(entry[1][0]), self.next_match_id))
+            try:
+                tokens = self.store.append_match(match)
+            except Exception:
+                self.entries.pop('matches', None)
+                raise
+            self.next_match_id = match['id'] + 1
+            rows = list(appearance_rows(match))
+            columns = {c: _extended(entry[1][1][c], [row[i] for row in rows]) for i, c in enumerate(APPEARANCE_COLUMNS)}
+            self.entries['matches'] = (entry[0], (entry[1][0] + [match], columns))
+            self._written(tokens)
+        return match
+
+    def update_match(self, match):
+        def change(history):
+            # New objects throughout: derived data must not take this for an append
+            matches = [match if m['id'] == match['id'] else dict(m) for m in history[0]]
+            return matches, _appearance_columns(matches)
+
+        self._edit('matches', lambda: self.store.update_match(match), change)
+
+    def delete_match(self, match_id):
+        with self.locks['matches']:
+            self.next_match_id = max(self.next_match_id, int(match_id) + 1)
+
+        def change(history):
+            matches = [dict(m) for m in history[0] if m['id'] != match_id]
+            return matches, _appearance_columns(matches)
+
+        self._edit('matches', lambda: self.store.delete_match(match_id), change)
+
+    def compact_matches(self):
+        self.store.compact_matches()
+
+    def sync_status(self):
+        return self.store.sync_status()
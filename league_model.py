@@ -0,0 +1,113 @@
+"""In-memory league model with name- and id-keyed indexes.
+
+The pages used to answer "is this player in that list?" by scanning lists of
+dicts.  :class:`League` wraps the same ``players`` and ``games`` lists the
+storage layer loads and keeps dict indexes next to them: players by
+normalised name, games by id, games in date order and each game's votes as a
+set.
+
+A League is shared by every session looking at the same data, so it is never
+changed in place.  The ``with_*`` / ``without_*`` methods return a new League
+over new lists that reuse every player and game dict they didn't touch; save
+its lists and let the storage cache hand the result to everyone.
+
+:func:`appended_since` does the same job for data derived from the match
+history: it tells a newly recorded match apart from any other change.
+"""
+
+import bisect
+
+
+def normalise_name(name):
+    """Key used to compare player names: case and spacing don't matter"""
+    return ' '.join(str(name).split()).casefold()
+
+
+class League:
+    """Players and games plus the indexes used on hot paths"""
+
+    def __init__(self, players, games):
+        self.players = players
+        self.games = games
+        self.players_by_name = {normalise_name(p['name']): p for p in players}
+        self.games_by_id = {g['id']: g for g in games}
+        self.votes_by_game = {g['id']: {normalise_name(v) for v in g['votes']} for g in games}
+        # (date, id) pairs, sorted; ISO dates sort as strings
+        self.games_by_date = sorted((str(g['date']), g['id']) for g in games)
+
+    # ------------------------------------------------------------------
+    # Players
+    # ------------------------------------------------------------------
+
+    def player(self, name):
+        """The player called ``name``, or None"""
+        return self.players_by_name.get(normalise_name(name))
+
+    def has_player(self, name):
+        return normalise_name(name) in self.players_by_name
+
+    def with_player(self, player):
+        return League(self.players + [player], self.games)
+
+    def with_player_changed(self, name, **changes):
+        """A league where player ``name`` has ``changes`` applied"""
+        key = normalise_name(name)
+        players = [dict(p, **changes) if normalise_name(p['name']) == key else p for p in self.players]
+        return League(players, self.games)
+
+    def without_player(self, name):
+        key = normalise_name(name)
+        return League([p for p in self.players if normalise_name(p['name']) != key], self.games)
+
+    # ------------------------------------------------------------------
+    # Games and votes
+    # ------------------------------------------------------------------
+
+    def game(self, game_id):
+        return self.games_by_id.get(game_id)
+
+    def with_game(self, game):
+        return League(self.players, self.games + [game])
+
+    def without_game(self, game_id):
+        return League(self.players, [g for g in self.games if g['id'] != game_id])
+
+    def next_game_id(self, floor=0):
+        """One more than any live game id, or than ``floor`` (e.g. the archive's highest)"""
+        return max(max(self.games_by_id, default=0), floor) + 1
+
+    def upcoming(self, today):
+        """Games on or after ``today`` (an ISO date), soonest first"""
+        start = bisect.bisect_left(self.games_by_date, (today,))
+        return [self.games_by_id[game_id] for _, game_id in self.games_by_date[start:]]
+
+    def past(self, today):
+        """Games before ``today`` that haven't been archived yet, oldest first"""
+        end = bisect.bisect_left(self.games_by_date, (today,))
+        return [self.games_by_id[game_id] for _, game_id in self.games_by_date[:end]]
+
+    def has_voted(self, game_id, name):
+        return normalise_name(name) in self.votes_by_game.get(game_id, ())
+
+    def voters(self, game_id):
+        """Registered players who voted for the game, in sign-up order"""
+        found = (self.players_by_name.get(normalise_name(v)) for v in self.games_by_id[game_id]['votes'])
+        return [p for p in found if p is not None]
+
+
+def history_mark(matches):
+    """(count, last match) of a match history, for :func:`appended_since`"""
+    return len(matches), (matches[-1] if matches else None)
+
+
+def appended_since(matches, mark):
+    """The matches added since ``mark`` was taken, or None if the history changed otherwise.
+
+    The storage cache records a match by keeping every earlier match object
+    and hands out new ones for any other change, so only the last match seen
+    needs checking.
+    """
+    seen, last = mark
+    if len(matches) < seen or (seen and matches[seen - 1] is not last):
+        return None
+    return matches[seen:]
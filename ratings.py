@@ -0,0 +1,212 @@
+"""Player ratings learned from match results.
+
+The hand-set 1-10 ``rating`` is only an admin's guess.  :class:`Ratings`
+starts every player there and moves them after each match, Elo style: a
+team's strength is the mean rating of its players, the winner is scored
+against every other team and each loser against the winner, and every player
+on a team moves by ``K_FACTOR * (result - expected)`` averaged over those
+pairings.  Ratings stay on the slider's scale, so the team generator can use
+them in its place.
+
+Recording a match touches only the players in it: their new ratings go in a
+small overlay over the previous Ratings' arrays, folded in once it holds
+``FOLD_AFTER`` players.  :func:`replay` rebuilds
+everything after a correction with NumPy: consecutive matches that share no
+player can't affect each other, so each such run ("wave") is updated in one
+step, giving the same numbers as going match by match.  That only pays off
+when waves hold several matches: in a small league where every match shares
+players each wave is one match, and a replay costs roughly as much as going
+match by match in Python (about a second for 20,000 matches).
+"""
+
+import numpy as np
+
+from league_model import appended_since, history_mark
+
+# Rating points between two teams' means that make the stronger one ten times
+# as likely to win
+SCALE = 4.0
+
+# Most rating points a player can gain or lose in one match
+K_FACTOR = 0.25
+
+# Overlay entries after which updated() folds them into new arrays
+FOLD_AFTER = 64
+
+
+def priors_of(players):
+    """Hand-set rating per player name: where learning starts"""
+    return {p['name']: float(p['rating']) for p in players}
+
+
+def _teams(match):
+    """[(player names, won)] for a match with one known winner, else None"""
+    teams = [(team['players'], team['name'] == match['winner']) for team in match['teams'] if team['players']]
+    if len(teams) < 2 or sum(won for _, won in teams) != 1:
+        return None
+    return teams
+
+
+def _pairings(teams):
+    """(team, opponent, result, weight) for every scored pairing of one match.
+
+    Losing teams aren't ranked against each other, so only pairings with the
+    winner count; the winner's are averaged over all the teams it beat.
+    """
+    winner = next(t for t, (_, won) in enumerate(teams) if won)
+    beaten = len(teams) - 1
+    pairs = []
+    for t in range(len(teams)):
+        if t != winner:
+            pairs.append((winner, t, 1.0, 1.0 / beaten))
+            pairs.append((t, winner, 0.0, 1.0))
+    return pairs
+
+
+def _expected(strength, opponent):
+    return 1.0 / (1.0 + 10.0 ** ((opponent - strength) / SCALE))
+
+
+class Ratings:
+    """Learned rating per player name, for one version of the match history.
+
+    Shared between sessions, so never changed in place.
+    """
+
+    def __init__(self, players, priors, index, values, matches, changes=None):
+        self.players = players
+        self.priors = priors
+        self.index = index
+        self.values = values
+        self.mark = history_mark(matches)
+        # Ratings moved since ``values`` was built, by name
+        self.changes = changes or {}
+
+    def get(self, name):
+        value = self.changes.get(name)
+        if value is not None:
+            return value
+        i = self.index.get(name)
+        if i is None:
+            return self.priors.get(name, _default(self.priors))
+        return float(self.values[i])
+
+    def rated(self, players):
+        """Copies of ``players`` with the learned rating, e.g. for the team generator"""
+        return [dict(p, rating=round(self.get(p['name']), 1)) for p in players]
+
+    def updated(self, players, matches):
+        """These ratings moved on by the matches appended since, or None if more changed"""
+        appended = appended_since(matches, self.mark)
+        if appended is None:
+            return None
+        if players is not self.players:
+            # Saving players keeps the dicts that didn't change
+            if len(players) != len(self.players):
+                return None
+            for p, q in zip(players, self.players):
+                if p is not q and (p['name'] != q['name'] or float(p['rating']) != float(q['rating'])):
+                    return None
+
+        changes = dict(self.changes)
+        for match in appended:
+            teams = _teams(match)
+            if teams is None:
+                continue
+            current = [[changes[name] if name in changes else self.get(name) for name in names] for names, _ in teams]
+            strengths = [sum(values) / len(values) for values in current]
+            change = [0.0] * len(teams)
+            for t, u, result, weight in _pairings(teams):
+                change[t] += weight * (result - _expected(strengths[t], strengths[u]))
+            for (names, _), values, c in zip(teams, current, change):
+                for name, value in zip(names, values):
+                    changes[name] = value + K_FACTOR * c
+
+        index, values = self.index, self.values
+        if len(changes) > FOLD_AFTER:
+            unseen = [name for name in changes if name not in index]
+            index = dict(index)
+            for name in unseen:
+                index[name] = len(index)
+            values = np.append(values, np.zeros(len(unseen)))
+            for name, value in changes.items():
+                values[index[name]] = value
+            changes = {}
+        return Ratings(players, self.priors, index, values, matches, changes)
+
+
+def _default(priors):
+    """Starting rating for names no longer on the roster"""
+    return sum(priors.values()) / len(priors) if priors else 5.0
+
+
+def replay(players, matches):
+    """Ratings after every match in ``matches`` (oldest first), from the hand-set ones"""
+    priors = priors_of(players)
+    default = _default(priors)
+    index = {name: i for i, name in enumerate(priors)}
+
+    # One row per player per team, one per team, one per scored pairing
+    row_player, row_team, team_size, team_wave = [], [], [], []
+    pair_team, pair_opponent, pair_result, pair_weight = [], [], [], []
+    last_wave = {}
+    for match in matches:
+        teams = _teams(match)
+        if teams is None:
+            continue
+        names = [name for members, _ in teams for name in members]
+        for name in names:
+            index.setdefault(name, len(index))
+        # After the last wave any of its players was in
+        wave = max(last_wave.get(name, -1) for name in names) + 1
+        for name in names:
+            last_wave[name] = wave
+        first = len(team_size)
+        for members, _ in teams:
+            row_player.extend(index[name] for name in members)
+            row_team.extend([len(team_size)] * len(members))
+            team_size.append(len(members))
+            team_wave.append(wave)
+        for t, u, result, weight in _pairings(teams):
+            pair_team.append(first + t)
+            pair_opponent.append(first + u)
+            pair_result.append(result)
+            pair_weight.append(weight)
+
+    values = np.array([priors.get(name, default) for name in index], dtype=float)
+    if not team_size:
+        return Ratings(players, priors, index, values, matches)
+
+    # Renumber teams so each wave's are contiguous, then sort rows and pairings to match
+    team_wave = np.array(team_wave)
+    order = np.argsort(team_wave, kind='stable')
+    label = np.empty_like(order)
+    label[order] = np.arange(len(order))
+    team_size = np.array(team_size, dtype=float)[order]
+    team_start = np.searchsorted(team_wave[order], np.arange(team_wave.max() + 2))
+
+    row_team = label[np.array(row_team)]
+    rows = np.argsort(row_team, kind='stable')
+    row_team, row_player = row_team[rows], np.array(row_player)[rows]
+    row_start = np.searchsorted(row_team, team_start)
+
+    pair_team = label[np.array(pair_team)]
+    pairs = np.argsort(pair_team, kind='stable')
+    pair_team = pair_team[pairs]
+    pair_opponent = label[np.array(pair_opponent)][pairs]
+    pair_result = np.array(pair_result)[pairs]
+    pair_weight = np.array(pair_weight)[pairs]
+    pair_start = np.searchsorted(pair_team, team_start)
+
+    for w in range(len(team_start) - 1):
+        t0, t1 = team_start[w], team_start[w + 1]
+        r0, r1 = row_start[w], row_start[w + 1]
+        p0, p1 = pair_start[w], pair_start[w + 1]
+        players_in = row_player[r0:r1]
+        teams_in = row_team[r0:r1] - t0
+        strengths = np.bincount(teams_in, weights=values[players_in], minlength=t1 - t0) / team_size[t0:t1]
+        t, u = pair_team[p0:p1] - t0, pair_opponent[p0:p1] - t0
+        surprise = pair_weight[p0:p1] * (pair_result[p0:p1] - _expected(strengths[t], strengths[u]))
+        change = np.bincount(t, weights=surprise, minlength=t1 - t0)
+        values[players_in] += K_FACTOR * change[teams_in]
+    return Ratings(players, priors, index, values, matches)
@@ -0,0 +1,267 @@
+"""Long-lived, quota-aware Google Sheets connection shared by every session.
+
+Authorizing, opening the spreadsheet and looking up worksheets each cost a
+round trip.  A :class:`SheetsConnection` does them once, on first use, and
+keeps the handles for the life of the process.  Worksheets are handed out as
+:class:`LazyWorksheet` proxies that resolve on first call.
+
+Every request then goes through :meth:`SheetsConnection.request`, which
+
+* coalesces identical reads already in flight into one request,
+* throttles reads and writes with token buckets sized to the per-minute quota,
+* retries 429 and 5xx responses with jittered exponential backoff,
+* reconnects once when the token has expired or the HTTP connection dropped,
+
+and raises whatever error is left instead of hiding it.
+"""
+
+import random
+import threading
+import time
+
+import gspread
+from google.auth.exceptions import RefreshError
+from google.oauth2.service_account import Credentials
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from requests.exceptions import ConnectionError
+
+from diagnostics import PROFILER, QUOTA_PER_MINUTE, READ_METHODS, payload_size
+
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+
+# Retries for 429 / 5xx, waiting up to BACKOFF_BASE * 2**attempt (capped) each time
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 32.0
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def _status(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def _needs_reconnect(error):
+    if isinstance(error, (RefreshError, ConnectionError)):
+        return True
+    return isinstance(error, gspread.exceptions.APIError) and _status(error) == 401
+
+
+def _retryable(error):
+    status = _status(error)
+    return isinstance(error, gspread.exceptions.APIError) and status is not None and (status == 429 or status >= 500)
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class TokenBucket:
+    """Allows ``capacity`` requests at once, refilling to that over ``period`` seconds"""
+
+    def __init__(self, capacity, period=60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Flight:
+    """A read in progress that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SheetsConnection:
+    """A gspread client, spreadsheet and worksheet handles, opened lazily"""
+
+    def __init__(self, credentials_info, sheet_id):
+        self.credentials_info = dict(credentials_info)
+        self.sheet_id = sheet_id
+        self.lock = threading.Lock()
+        self._spreadsheet = None
+        self._worksheets = {}
+        self.read_bucket = TokenBucket(QUOTA_PER_MINUTE)
+        self.write_bucket = TokenBucket(QUOTA_PER_MINUTE)
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Handles
+    # ------------------------------------------------------------------
+
+    def spreadsheet(self):
+        with self.lock:
+            if self._spreadsheet is None:
+                start = time.perf_counter()
+                credentials = Credentials.from_service_account_info(self.credentials_info, scopes=SCOPES)
+                gc = gspread.authorize(credentials)
+                self._spreadsheet = gc.open_by_key(self.sheet_id)
+                PROFILER.record_sheets_request('open_by_key', time.perf_counter() - start)
+            return self._spreadsheet
+
+    def open_worksheet(self, title):
+        """The real gspread worksheet, looked up once and created if missing"""
+        spreadsheet = self.spreadsheet()
+        with self.lock:
+            if title not in self._worksheets:
+                start = time.perf_counter()
+                try:
+                    self._worksheets[title] = spreadsheet.worksheet(title)
+                except gspread.exceptions.WorksheetNotFound:
+                    # Tables added after the spreadsheet was set up, e.g. Appearances
+                    self._worksheets[title] = spreadsheet.add_worksheet(title, rows=1000, cols=26)
+                PROFILER.record_sheets_request('fetch_sheet_metadata', time.perf_counter() - start)
+            return self._worksheets[title]
+
+    def worksheet(self, title):
+        """A proxy for ``title`` that connects on first use"""
+        return LazyWorksheet(self, title)
+
+    def values_batch_get(self, ranges):
+        """Several ranges, e.g. whole worksheets, in a single request"""
+        ranges = list(ranges)
+        return self.request(
+            'batch_get',
+            lambda: self.spreadsheet().values_batch_get(ranges),
+            payload=ranges,
+            key=('batch_get', tuple(ranges))
+        )
+
+    def revision(self):
+        """Drive's version number for the spreadsheet, bumped by every edit"""
+        def fetch():
+            response = self.spreadsheet().client.request(
+                'get',
+                f"{DRIVE_FILES_API_V3_URL}/{self.sheet_id}",
+                params={'fields': 'version', 'supportsAllDrives': True}
+            )
+            return response.json()['version']
+
+        return self.request('drive_version', fetch, key=('drive_version',))
+
+    def reset(self):
+        """Drop the client and handles so the next call reconnects"""
+        with self.lock:
+            self._spreadsheet = None
+            self._worksheets = {}
+
+    # ------------------------------------------------------------------
+    # Requests
+    # ------------------------------------------------------------------
+
+    def request(self, method, fn, payload=None, key=None):
+        """Send one API request; reads with the same ``key`` share one flight"""
+        if key is None or method not in READ_METHODS:
+            return self._send(method, fn, payload)
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._send(method, fn, payload)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _send(self, method, fn, payload):
+        bucket = self.read_bucket if method in READ_METHODS else self.write_bucket
+        attempt = 0
+        while True:
+            bucket.take()
+            start = time.perf_counter()
+            result, failed = None, True
+            try:
+                result = self.call(fn)
+                failed = False
+                return result
+            except Exception as e:
+                if not _retryable(e) or attempt >= MAX_RETRIES:
+                    raise
+            finally:
+                PROFILER.record_sheets_request(
+                    method,
+                    time.perf_counter() - start,
+                    payload_size(payload) + payload_size(result),
+                    error=failed
+                )
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    def call(self, fn):
+        """Run ``fn``, reconnecting and retrying once if the session went stale"""
+        try:
+            return fn()
+        except Exception as e:
+            if not _needs_reconnect(e):
+                raise
+        self.reset()
+        return fn()
+
+
+class LazyWorksheet:
+    """Stands in for a gspread Worksheet owned by a :class:`SheetsConnection`"""
+
+    def __init__(self, connection, title):
+        self.connection = connection
+        self.title = title
+
+    def __getattr__(self, name):
+        attr = getattr(self.connection.open_worksheet(self.title), name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self.connection.request(
+                name,
+                lambda: getattr(self.connection.open_worksheet(self.title), name)(*args, **kwargs),
+                payload=[args, kwargs],
+                key=(self.title, name, repr(args), repr(sorted(kwargs.items())))
+            )
+
+        return call
+
+
+def get_connection(sheet_id, credentials_info):
+    """The process-wide connection for ``sheet_id``"""
+    with _connections_lock:
+        if sheet_id not in _connections:
+            _connections[sheet_id] = SheetsConnection(credentials_info, sheet_id)
+        return _connections[sheet_id]
@@ -0,0 +1,244 @@
+"""Diff-based writes for Google Sheets worksheets.
+
+Every worksheet the app owns is a plain table: a header row followed by one
+row per record.  Instead of ``clear()`` + one ``append_row`` per record, a
+:class:`SheetTable` keeps the last-known contents of its worksheet and pushes
+only the cells that changed in a single ``batch_update`` call.  When most rows
+changed it falls back to one full-range ``update``.  Append-only tables use
+:meth:`SheetTable.append_rows`, which adds rows without touching the rest.
+"""
+
+import threading
+
+from gspread.utils import numericise_all, rowcol_to_a1
+
+# When more than this share of rows changed, one full-range write is cheaper
+# to send than a scatter of per-row ranges.
+FULL_WRITE_THRESHOLD = 0.5
+
+# Last-known cell values per worksheet, shared by every session in the process
+_mirrors = {}
+_headers_checked = set()
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _mirror_key(worksheet):
+    return (worksheet.spreadsheet.id, worksheet.id)
+
+
+def _lock_for(key):
+    with _locks_guard:
+        if key not in _locks:
+            _locks[key] = threading.RLock()
+        return _locks[key]
+
+
+def _cell(value):
+    """String form of a value, as the Sheets API hands it back"""
+    if value is None:
+        return ''
+    return str(value)
+
+
+def _pad(row, width):
+    return list(row) + [''] * (width - len(row))
+
+
+class SheetTable:
+    """A worksheet holding a header row and one row per record"""
+
+    def __init__(self, worksheet, header):
+        self.worksheet = worksheet
+        self.header = list(header)
+        self._key = None
+
+    @property
+    def key(self):
+        # Looked up on use so a lazily opened worksheet stays unopened until then
+        if self._key is None:
+            self._key = _mirror_key(self.worksheet)
+        return self._key
+
+    def open(self):
+        """Look the worksheet up now, creating it if the spreadsheet hasn't got it yet"""
+        return self.key
+
+    @property
+    def lock(self):
+        """Held across a read-modify-write to keep other sessions' writes out"""
+        return _lock_for(self.key)
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def fetch_values(self):
+        """Read the whole worksheet and remember it as the last-known state"""
+        # Held across the read too, so a write in this process can't land
+        # between it and the mirror being replaced
+        with self.lock:
+            return self.accept_values(self.worksheet.get_all_values())
+
+    def accept_values(self, values):
+        """Remember values read some other way, e.g. in a batch_get"""
+        mirror = [[_cell(v) for v in row] for row in values]
+        # Never swapped out from under a write that is diffing against it
+        with self.lock:
+            _mirrors[self.key] = mirror
+        return values
+
+    def read_records(self):
+        """Read the worksheet as a list of dicts, like ``get_all_records``"""
+        return self.records(self.fetch_values())
+
+    def records(self, values):
+        if not values:
+            return []
+        keys = values[0]
+        return [dict(zip(keys, numericise_all(_pad(row, len(keys))))) for row in values[1:]]
+
+    def read_columns(self):
+        """Read the worksheet as a dict of column lists, one per header name"""
+        return self.columns(self.fetch_values())
+
+    def columns(self, values):
+        if not values:
+            return {name: [] for name in self.header}
+        rows = [_pad(row, len(values[0])) for row in values[1:]]
+        # Positions come from the sheet's header so reordered columns still line up
+        positions = {name: i for i, name in enumerate(values[0])}
+        return {
+            name: numericise_all([row[positions[name]] if name in positions else '' for row in rows])
+            for name in self.header
+        }
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def write_rows(self, rows):
+        """Make the worksheet hold the header plus ``rows``.
+
+        Costs one API call when the last-known contents are available and two
+        (a read, then a write) the first time a worksheet is saved.
+        """
+        with self.lock:
+            old = _mirrors.get(self.key)
+            if old is None:
+                self.fetch_values()
+                old = _mirrors[self.key]
+
+            new_values = [self.header] + [list(r) for r in rows]
+            new_cells = [[_cell(v) for v in row] for row in new_values]
+            width = max([len(r) for r in new_cells + old] or [1])
+
+            changed = []
+            for i in range(max(len(new_cells), len(old))):
+                new_row = _pad(new_cells[i] if i < len(new_cells) else [], width)
+                old_row = _pad(old[i] if i < len(old) else [], width)
+                if new_row != old_row:
+                    changed.append(i)
+
+            if not changed:
+                return
+
+            self._ensure_grid(len(new_values), width)
+
+            if len(changed) > FULL_WRITE_THRESHOLD * max(len(new_cells), len(old)):
+                self._write_full(new_values, len(old), width)
+            else:
+                self._write_changed(new_values, changed, width)
+
+            _mirrors[self.key] = new_cells
+
+    def append_rows(self, rows):
+        """Add ``rows`` after the last record in one call, leaving the rest alone"""
+        with self.lock:
+            old = _mirrors.get(self.key)
+            self._ensure_header(old)
+            self.worksheet.append_rows(
+                [list(r) for r in rows],
+                value_input_option='RAW',
+                table_range='A1'
+            )
+            if old is not None:
+                old.extend([_cell(v) for v in row] for row in rows)
+
+    def update_rows(self, rows_by_index):
+        """Overwrite the records at these 0-based positions in one call, leaving the rest alone.
+
+        Unlike :meth:`write_rows` this never rewrites rows it wasn't given, so
+        it can't undo another process's change to them.
+        """
+        with self.lock:
+            old = _mirrors.get(self.key)
+            self._ensure_header(old)
+            data = [{
+                'range': f"{rowcol_to_a1(i + 2, 1)}:{rowcol_to_a1(i + 2, len(row))}",
+                'values': [list(row)]
+            } for i, row in sorted(rows_by_index.items())]
+            self.worksheet.batch_update(data, value_input_option='RAW')
+            if old is not None:
+                for i, row in rows_by_index.items():
+                    while len(old) < i + 2:
+                        old.append([])
+                    old[i + 1] = [_cell(v) for v in row]
+
+    def _ensure_header(self, old):
+        """Bring the header row up to date before appending under it"""
+        if self.key in _headers_checked:
+            return
+        current = old[0] if old else self.worksheet.row_values(1)
+        if [_cell(v) for v in current] != self.header:
+            self.worksheet.update(
+                range_name=f"A1:{rowcol_to_a1(1, len(self.header))}",
+                values=[self.header],
+                value_input_option='RAW'
+            )
+            if old:
+                old[0] = list(self.header)
+            elif old is not None:
+                old.append(list(self.header))
+        _headers_checked.add(self.key)
+
+    def _ensure_grid(self, num_rows, num_cols):
+        """Grow the worksheet if the data no longer fits in its grid"""
+        ws = self.worksheet
+        if num_rows > ws.row_count:
+            ws.add_rows(num_rows - ws.row_count)
+        if num_cols > ws.col_count:
+            ws.add_cols(num_cols - ws.col_count)
+
+    def _write_full(self, new_values, old_len, width):
+        # Blank out rows left over from a longer previous table in the same call
+        values = [_pad(row, width) for row in new_values]
+        values += [[''] * width for _ in range(old_len - len(new_values))]
+        self.worksheet.update(
+            range_name=f"A1:{rowcol_to_a1(len(values), width)}",
+            values=values,
+            value_input_option='RAW'
+        )
+
+    def _write_changed(self, new_values, changed, width):
+        # Group consecutive changed rows into one range each
+        runs = []
+        for i in changed:
+            if runs and runs[-1][-1] == i - 1:
+                runs[-1].append(i)
+            else:
+                runs.append([i])
+
+        data = []
+        for run in runs:
+            data.append({
+                'range': f"{rowcol_to_a1(run[0] + 1, 1)}:{rowcol_to_a1(run[-1] + 1, width)}",
+                'values': [_pad(new_values[i] if i < len(new_values) else [], width) for i in run]
+            })
+        self.worksheet.batch_update(data, value_input_option='RAW')
+
+
+def forget(worksheet):
+    """Drop the last-known contents so the next write re-reads the sheet"""
+    _mirrors.pop(_mirror_key(worksheet), None)
+    _headers_checked.discard(_mirror_key(worksheet))
@@ -0,0 +1,229 @@
+"""Local columnar snapshot of the league for fast cold starts.
+
+A restarted process used to download every worksheet and convert each row to
+a dict before the first page could render.  :class:`SnapshotStorage` keeps
+what the backend last returned as Arrow IPC files, one per table, each tagged
+with the backend's :meth:`~storage.Storage.revision` at the time.  A load asks
+for the current revision (one small request), memory-maps the tables still
+tagged with it and fetches only the datasets that changed, in one batch.
+
+The files are a cache: deleting the directory just means the next load goes
+to the backend.
+"""
+
+import json
+import os
+import threading
+
+import pyarrow as pa
+
+from storage import Storage
+
+SNAPSHOT_DIR = '.league_snapshot'
+
+# Tables behind each dataset
+TABLES = {
+    'players': ['players'],
+    'games': ['games'],
+    'archive': ['archive'],
+    'matches': ['matches', 'appearances'],
+}
+
+# ============================================================================
+# ARROW ENCODING
+# ============================================================================
+
+def _needs_json(values):
+    # Teams are lists of dicts whose keys vary between old and new matches
+    return any(isinstance(v, dict) or (isinstance(v, list) and any(isinstance(x, dict) for x in v)) for v in values)
+
+
+def _column(values):
+    """(arrow array, metadata): nested or mixed-type values go in as JSON text"""
+    if not _needs_json(values):
+        try:
+            return pa.array(values), None
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+    return pa.array([json.dumps(v) for v in values]), {b'json': b'1'}
+
+
+def columns_to_table(columns):
+    fields, arrays = [], []
+    for name, values in columns.items():
+        array, metadata = _column(values)
+        fields.append(pa.field(name, array.type, metadata=metadata))
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def table_to_columns(table):
+    columns = {}
+    for field, column in zip(table.schema, table.columns):
+        values = column.to_pylist()
+        if field.metadata and field.metadata.get(b'json'):
+            values = [json.loads(v) for v in values]
+        columns[field.name] = values
+    return columns
+
+
+def records_to_columns(records):
+    names = list(dict.fromkeys(k for r in records for k in r))
+    return {name: [r.get(name) for r in records] for name in names}
+
+
+def columns_to_records(columns):
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+
+def encode(name, data):
+    """Dataset -> {table name: columns}"""
+    if name == 'matches':
+        matches, appearances = data
+        return {'matches': records_to_columns(matches), 'appearances': appearances}
+    return {name: records_to_columns(data)}
+
+
+def decode(name, tables):
+    """{table name: columns} -> dataset"""
+    if name == 'matches':
+        return columns_to_records(tables['matches']), tables['appearances']
+    return columns_to_records(tables[name])
+
+# ============================================================================
+# STORAGE WRAPPER
+# ============================================================================
+
+class SnapshotStorage(Storage):
+    """Serves loads from Arrow files in ``path`` while ``store``'s revision is unchanged"""
+
+    def __init__(self, store, path=SNAPSHOT_DIR):
+        self.store = store
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.meta = self._read_meta()
+
+    # ------------------------------------------------------------------
+    # Files
+    # ------------------------------------------------------------------
+
+    def _file(self, table):
+        return os.path.join(self.path, f"{table}.arrow")
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.path, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self):
+        meta_path = os.path.join(self.path, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _read(self, name):
+        tables = {}
+        for table in TABLES[name]:
+            # Memory-mapped: the columns are read straight from the page cache
+            with pa.memory_map(self._file(table)) as source:
+                tables[table] = table_to_columns(pa.ipc.open_file(source).read_all())
+        return decode(name, tables)
+
+    def _write(self, name, data, revision):
+        for table, columns in encode(name, data).items():
+            arrow_table = columns_to_table(columns)
+            tmp = self._file(table) + '.tmp'
+            with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, arrow_table.schema) as writer:
+                writer.write_table(arrow_table)
+            os.replace(tmp, self._file(table))
+        self.meta[name] = revision
+        self._write_meta()
+
+    # ------------------------------------------------------------------
+    # Loads
+    # ------------------------------------------------------------------
+
+    def load_many(self, names):
+        # Read before loading: a write landing in between leaves the snapshot
+        # tagged with the older revision, so it is refetched next time
+        revision = self.store.revision()
+        data = {}
+        with self.lock:
+            if revision is not None:
+                for name in names:
+                    if self.meta.get(name) == revision:
+                        try:
+                            data[name] = self._read(name)
+                        except (OSError, pa.ArrowInvalid):
+                            pass
+            missing = [name for name in names if name not in data]
+            if missing:
+                fetched = self.store.load_many(missing)
+                if revision is not None:
+                    for name, value in fetched.items():
+                        self._write(name, value, revision)
+                data.update(fetched)
+        return data
+
+    def load_players(self):
+        return self.load_many(['players'])['players']
+
+    def load_games(self):
+        return self.load_many(['games'])['games']
+
+    def load_archive(self):
+        return self.load_many(['archive'])['archive']
+
+    def load_history(self):
+        return self.load_many(['matches'])['matches']
+
+    def revision(self):
+        return self.store.revision()
+
+    def versions(self):
+        return self.store.versions()
+
+    def watch_versions(self, callback):
+        self.store.watch_versions(callback)
+
+    # ------------------------------------------------------------------
+    # Writes go straight through; they change the revision
+    # ------------------------------------------------------------------
+
+    def save_players(self, players):
+        return self.store.save_players(players)
+
+    def save_games(self, games):
+        return self.store.save_games(games)
+
+    def append_votes(self, rows):
+        return self.store.append_votes(rows)
+
+    @property
+    def atomic_votes(self):
+        return self.store.atomic_votes
+
+    def cast_vote(self, game_id, player, action):
+        return self.store.cast_vote(game_id, player, action)
+
+    def save_matches(self, matches):
+        return self.store.save_matches(matches)
+
+    def append_match(self, match):
+        return self.store.append_match(match)
+
+    def append_matches(self, matches):
+        return self.store.append_matches(matches)
+
+    def update_match(self, match):
+        return self.store.update_match(match)
+
+    def delete_match(self, match_id):
+        return self.store.delete_match(match_id)
+
+    def compact_matches(self):
+        return self.store.compact_matches()
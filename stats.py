@@ -0,0 +1,230 @@
+"""Leaderboard and player stats derived from match history.
+
+Stats used to be counters on each player, bumped by the Record Match Result
+button, so they drifted whenever a save failed or a match was deleted.
+:class:`LeagueStats` derives them from the matches instead: it builds one row
+per player per match from the stored appearances table and aggregates that
+with pandas.
+One LeagueStats is shared by every session viewing the same match history, so
+it is never changed in place; recording a match builds the next one.
+:meth:`LeagueStats.updated` makes that cheap: the new match's rows are added
+to the totals and the match waits in a short tail next to the date index,
+which is only rebuilt once ``REINDEX_AFTER`` matches have piled up.
+
+Matches are also indexed by date: each is ranked by (date, id), and every
+player's appearances are kept sorted by rank next to a running win count.
+Totals for any window of matches (a season, a month, the last N) are then
+two binary searches per player instead of a scan of the history.
+"""
+
+import calendar
+from datetime import date
+
+
+import numpy as np
+import pandas as pd
+
+from league_model import appended_since, history_mark
+
+APPEARANCE_COLUMNS = ['match_id', 'date', 'player', 'team', 'captain', 'won']
+
+# Matches appended to a LeagueStats before the date index is rebuilt
+REINDEX_AFTER = 200
+
+
+def appearance_rows(match):
+    """One (match_id, date, player, team, captain, won) tuple per player"""
+    for team in match['teams']:
+        won = team['name'] == match['winner']
+        for name in team['players']:
+            yield (match['id'], match['date'], name, team['name'], name == team['captain'], won)
+
+
+def appearances_frame(matches):
+    rows = [row for m in matches for row in appearance_rows(m)]
+    return pd.DataFrame(rows, columns=APPEARANCE_COLUMNS)
+
+
+def appearances_from_columns(columns, matches):
+    """Appearance frame from storage's appearance columns, dated via ``matches``"""
+    # Columns the cache has appended to are object arrays; ids go back to numbers
+    stored = pd.DataFrame(columns).infer_objects()
+    dates = pd.Series({m['id']: m['date'] for m in matches}, dtype=object)
+    return pd.DataFrame({
+        'match_id': stored['match_id'],
+        'date': stored['match_id'].map(dates),
+        'player': stored['player'],
+        'team': stored['team'],
+        'captain': stored['captain'].astype(bool),
+        'won': stored['winner'].astype(bool)
+    }, columns=APPEARANCE_COLUMNS)
+
+
+def player_totals(appearances):
+    """matches_played / matches_won / points per player"""
+    grouped = appearances.groupby('player')['won']
+    totals = pd.DataFrame({
+        'matches_played': grouped.size(),
+        'matches_won': grouped.sum().astype(int)
+    })
+    totals['points'] = totals['matches_won']
+    return totals
+
+
+class LeagueStats:
+    """Per-player totals and the date index for one version of the match history"""
+
+    def __init__(self, matches, appearances=None):
+        if appearances is None:
+            frame = appearances_frame(matches)
+        else:
+            frame = appearances_from_columns(appearances, matches)
+        self.totals = player_totals(frame)
+        self._index_dates(frame)
+        self.mark = history_mark(matches)
+        # Matches ranked after the indexed ones: a [(player, won)] list each
+        self.tail = []
+
+    def _index_dates(self, apps):
+        days = pd.to_datetime(apps['date'], errors='coerce', format='%Y-%m-%d')
+        dated = pd.DataFrame({'match_id': apps['match_id'], 'day': days}).dropna()
+        matches = dated.drop_duplicates('match_id').sort_values(['day', 'match_id'], kind='stable')
+        # Match dates in rank order: the date index
+        self.match_days = matches['day'].to_numpy().astype('datetime64[D]')
+        self.indexed = len(matches)
+        self.last_key = (self.match_days[-1], matches['match_id'].iloc[-1]) if len(matches) else None
+        rank = pd.Series(np.arange(len(matches)), index=matches['match_id'].to_numpy())
+
+        rows = apps[apps['match_id'].isin(rank.index)]
+        codes, self.timeline_players = pd.factorize(rows['player'])
+        # One sorted key per appearance: player code, then match rank
+        keys = codes.astype(np.int64) * max(len(matches), 1) + rank.reindex(rows['match_id']).to_numpy()
+        order = np.argsort(keys, kind='stable')
+        self.timeline_keys = keys[order]
+        self.timeline_wins = np.concatenate([[0], np.cumsum(rows['won'].to_numpy()[order].astype(np.int64))])
+
+    def updated(self, matches, appearances=None):
+        """These stats plus the matches appended since, or None if more changed.
+
+        A match dated before the last indexed one needs a rebuild to rank it.
+        """
+        appended = appended_since(matches, self.mark)
+        if appended is None:
+            return None
+        new = object.__new__(LeagueStats)
+        new.__dict__.update(self.__dict__)
+        new.mark = history_mark(matches)
+        new.tail = list(self.tail)
+
+        added = [row for m in appended for row in appearance_rows(m)]
+        if added:
+            totals = self.totals.add(player_totals(pd.DataFrame(added, columns=APPEARANCE_COLUMNS)), fill_value=0)
+            new.totals = totals.astype(np.int64)
+        days = []
+        for match in appended:
+            rows = [(name, won) for _, _, name, _, _, won in appearance_rows(match)]
+            day = pd.to_datetime(match['date'], errors='coerce', format='%Y-%m-%d')
+            if not rows or pd.isna(day):
+                # Counted in the totals but in no window, as in a full build
+                continue
+            key = (np.datetime64(day, 'D'), match['id'])
+            if new.last_key is not None and key <= new.last_key:
+                return None
+            new.last_key = key
+            new.tail.append(rows)
+            days.append(key[0])
+        if len(new.tail) > REINDEX_AFTER:
+            return None
+        if days:
+            # One date per match is cheap to copy; the per-appearance timeline isn't
+            new.match_days = np.concatenate([self.match_days, np.array(days, dtype='datetime64[D]')])
+        return new
+
+    # ------------------------------------------------------------------
+    # Windows of matches, as (first rank, end rank) pairs
+    # ------------------------------------------------------------------
+
+    def match_range(self, start=None, end=None):
+        """Matches dated from ``start`` to ``end``, both included; None leaves that side open"""
+        lo = 0 if start is None else int(np.searchsorted(self.match_days, np.datetime64(start, 'D'), 'left'))
+        hi = len(self.match_days) if end is None else int(np.searchsorted(self.match_days, np.datetime64(end, 'D'), 'right'))
+        return lo, max(lo, hi)
+
+    def last_matches(self, count):
+        total = len(self.match_days)
+        return max(total - count, 0), total
+
+    def season(self, year):
+        return self.match_range(date(year, 1, 1), date(year, 12, 31))
+
+    def month(self, year, month):
+        return self.match_range(date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1]))
+
+    def seasons(self):
+        """Years with matches, latest first"""
+        years = np.unique(self.match_days.astype('datetime64[Y]').astype(int)) + 1970
+        return [int(y) for y in years[::-1]]
+
+    def months(self):
+        """(year, month) pairs with matches, latest first"""
+        months = np.unique(self.match_days.astype('datetime64[M]').astype(int))
+        return [(int(m) // 12 + 1970, int(m) % 12 + 1) for m in months[::-1]]
+
+    def window_totals(self, window):
+        """matches_played / matches_won / points per player over a window of matches"""
+        lo, hi = window
+        indexed = self.indexed
+        span = max(indexed, 1)
+        base = np.arange(len(self.timeline_players), dtype=np.int64) * span
+        first = np.searchsorted(self.timeline_keys, base + min(lo, indexed), 'left')
+        last = np.searchsorted(self.timeline_keys, base + min(hi, indexed), 'left')
+        totals = pd.DataFrame({
+            'matches_played': last - first,
+            'matches_won': self.timeline_wins[last] - self.timeline_wins[first]
+        }, index=pd.Index(self.timeline_players, name='player'))
+        recent = [row for rows in self.tail[max(lo - indexed, 0):max(hi - indexed, 0)] for row in rows]
+        if recent:
+            totals = totals.add(player_totals(pd.DataFrame(recent, columns=['player', 'won'])), fill_value=0)
+            totals = totals[['matches_played', 'matches_won']].astype(np.int64)
+        totals['points'] = totals['matches_won']
+        return totals[totals['matches_played'] > 0]
+
+    def player_stats(self, players, window=None):
+        """Totals for every registered player, in roster order, zeros for no matches.
+
+        ``window`` limits them to a range from e.g. :meth:`season`; None is all time.
+        """
+        names = [p['name'] for p in players]
+        totals = self.totals if window is None else self.window_totals(window)
+        stats = totals.reindex(names, fill_value=0)
+        stats['rating'] = [p['rating'] for p in players]
+        stats['strength'] = [p['strength'] for p in players]
+        played = stats['matches_played'].to_numpy()
+        won = stats['matches_won'].to_numpy()
+        stats['win_rate'] = np.divide(won * 100.0, played, out=np.zeros(len(stats)), where=played > 0)
+        return stats
+
+    def leaderboard(self, players, window=None):
+        """Player Rankings table, best first"""
+        stats = self.player_stats(players, window).sort_values('points', ascending=False, kind='stable')
+        return pd.DataFrame({
+            'Rank': [f"#{i}" for i in range(1, len(stats) + 1)],
+            'Player': stats.index,
+            'Points': stats['points'].to_numpy(),
+            'Matches': stats['matches_played'].to_numpy(),
+            'Wins': stats['matches_won'].to_numpy(),
+            'Win Rate': [f"{r:.1f}%" for r in stats['win_rate']],
+            'Rating': stats['rating'].to_numpy()
+        })
+
+    def with_counters(self, players):
+        """``players`` with the derived totals copied on, so the Players sheet matches.
+
+        Returns a new list; only players whose counters changed get new dicts.
+        """
+        stats = self.player_stats(players)
+        updated = []
+        for p, (played, won, points) in zip(players, stats[['matches_played', 'matches_won', 'points']].to_numpy()):
+            counters = {'matches_played': int(played), 'matches_won': int(won), 'points': int(points)}
+            updated.append(p if all(p.get(k) == v for k, v in counters.items()) else dict(p, **counters))
+        return updated
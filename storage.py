@@ -0,0 +1,838 @@
+"""Storage backends for league data.
+
+The app talks to a :class:`Storage` object instead of gspread directly.
+:class:`SheetsStorage` keeps the data in the league's Google Sheet;
+:class:`SQLiteStorage` keeps it in a local database file so the app can run
+offline, in tests and in benchmarks.  :func:`open_storage` picks one from the
+``[storage]`` section of the Streamlit secrets or the ``LEAGUE_STORAGE`` /
+``LEAGUE_DB_PATH`` / ``LEAGUE_SHEET_ID`` / ``LEAGUE_CACHE_TTL`` environment
+variables.
+"""
+
+import json
+import os
+import sqlite3
+from contextlib import ExitStack
+import threading
+import uuid
+from datetime import date, datetime, timezone
+
+from league_model import normalise_name
+
+SHEET_ID = "1D7UKzNNOQczbO5puSbGWHFwRt58Erk_G44hleUlMZlg"
+
+PLAYER_COLUMNS = ['name', 'rating', 'strength', 'matches_played', 'matches_won', 'points']
+GAME_COLUMNS = ['id', 'date', 'time', 'location', 'type', 'max_players', 'votes', 'created_by']
+MATCH_COLUMNS = ['date', 'game_id', 'winner', 'num_teams', 'teams_data', 'id']
+
+# One row per player per match. Matches recorded before this table existed
+# keep their teams as JSON in teams_data; newer ones leave it blank.
+APPEARANCE_COLUMNS = ['match_id', 'team', 'player', 'captain', 'winner']
+
+# The Matches sheet is an append-only journal: an edit is a new row with the
+# same id, a delete is a row with only the id and the deleted flag set
+MATCH_JOURNAL_COLUMNS = MATCH_COLUMNS + ['deleted']
+
+# Superseded journal rows tolerated before a load kicks off a compaction;
+# rows still holding teams_data get one straight away
+COMPACT_AFTER = 50
+
+# Votes are an append-only log replayed over the Games sheet's votes column,
+# so a click is one small append and two sessions can't overwrite each other
+VOTE_COLUMNS = ['game_id', 'player', 'action', 'timestamp']
+VOTE_IN = 'in'
+VOTE_OUT = 'out'
+VOTE_CLEAR = 'clear'  # the game was deleted; its id may be reused
+
+# One row per dataset holding a token that every write replaces, so other
+# processes can tell what changed with one tiny read instead of reloading
+VERSION_COLUMNS = ['dataset', 'version']
+VERSIONED_DATASETS = ['players', 'games', 'archive', 'matches']
+
+# Games dated before today move from the Games sheet to GamesArchive (same
+# columns, votes frozen) the next time games are saved, so the live list stays
+# short; loads leave them where they are and list them with the archive
+
+# ============================================================================
+# ROW ENCODING
+# ============================================================================
+
+def player_row(p):
+    return [
+        p['name'],
+        p['rating'],
+        p['strength'],
+        p['matches_played'],
+        p['matches_won'],
+        p['points']
+    ]
+
+def game_row(g):
+    return [
+        g['id'],
+        g['date'],
+        g['time'],
+        g['location'],
+        g['type'],
+        g['max_players'],
+        ','.join(g['votes']),  # Convert list to comma-separated string
+        g['created_by']
+    ]
+
+def match_row(m):
+    return [
+        m['date'],
+        m['game_id'],
+        m['winner'],
+        m['num_teams'],
+        '',  # Teams live in the appearances table
+        m['id']
+    ]
+
+def appearance_rows(m):
+    return [
+        [
+            m['id'],
+            team['name'],
+            name,
+            int(name == team['captain']),
+            int(team['name'] == m['winner'])
+        ]
+        for team in m['teams']
+        for name in team['players']
+    ]
+
+def vote_row(game_id, player, action, timestamp=None):
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    return [game_id, player, action, timestamp]
+
+def decode_game(game):
+    # Convert votes back to list
+    game['votes'] = game['votes'].split(',') if game['votes'] else []
+    return game
+
+def fold_matches(records):
+    """Replay the match journal into the current list of matches"""
+    matches = {}
+    for i, match in enumerate(records, 1):
+        # Rows written before the journal existed have no id; number them by position
+        match_id = match.get('id') or i
+        if match.pop('deleted', None):
+            matches.pop(match_id, None)
+        else:
+            match['id'] = match_id
+            matches[match_id] = match
+    return list(matches.values())
+
+def apply_vote(game, player, action):
+    """Apply one vote event to ``game['votes']``; False if it changes nothing.
+
+    An 'in' for a full game is refused, so replaying the log in order lets in
+    the first ``max_players`` players no matter whose session was stale.
+    """
+    votes = game['votes']
+    if action == VOTE_CLEAR:
+        changed = bool(votes)
+        votes.clear()
+        return changed
+    key = normalise_name(player)
+    present = any(normalise_name(v) == key for v in votes)
+    if action == VOTE_IN:
+        if present or len(votes) >= int(game['max_players']):
+            return False
+        votes.append(player)
+        return True
+    if action == VOTE_OUT and present:
+        votes[:] = [v for v in votes if normalise_name(v) != key]
+        return True
+    return False
+
+def fold_votes(games, records):
+    """Replay the vote log over the games' stored votes"""
+    games_by_id = {g['id']: g for g in games}
+    for r in records:
+        game = games_by_id.get(r['game_id'])
+        if game is not None:
+            apply_vote(game, str(r['player']), r['action'])
+    return games
+
+def split_past_games(games, today=None):
+    """(live, past): games on or after ``today`` (ISO date, default today) and before it"""
+    today = today or date.today().isoformat()
+    live = [g for g in games if str(g['date']) >= today]
+    past = [g for g in games if str(g['date']) < today]
+    return live, past
+
+def fold_archive(games):
+    """Archived games by date; a game archived twice keeps its last copy"""
+    return sorted({g['id']: g for g in games}.values(), key=lambda g: str(g['date']))
+
+def build_history(match_records, appearances):
+    """Matches with their teams, and the appearance columns for live matches.
+
+    ``appearances`` is a dict of APPEARANCE_COLUMNS lists, as stored.
+    """
+    matches = fold_matches(match_records)
+    live = {m['id'] for m in matches}
+    keep = [i for i, match_id in enumerate(appearances['match_id']) if match_id in live]
+    columns = {c: [appearances[c][i] for i in keep] for c in APPEARANCE_COLUMNS}
+    columns['team'] = [str(v) for v in columns['team']]
+    columns['player'] = [str(v) for v in columns['player']]
+
+    teams_by_match = {}
+    for match_id, team, player, captain in zip(columns['match_id'], columns['team'], columns['player'], columns['captain']):
+        teams = teams_by_match.setdefault(match_id, {})
+        t = teams.setdefault(team, {'name': team, 'captain': None, 'players': []})
+        t['players'].append(player)
+        if captain:
+            t['captain'] = player
+
+    for match in matches:
+        teams_data = match.pop('teams_data', '')
+        if teams_data:
+            # Recorded before the appearances table: convert teams back from JSON
+            match['teams'] = json.loads(teams_data)
+            for row in appearance_rows(match):
+                for c, v in zip(APPEARANCE_COLUMNS, row):
+                    columns[c].append(v)
+        else:
+            match['teams'] = list(teams_by_match.get(match['id'], {}).values())
+    return matches, columns
+
+def rows_to_columns(rows, names):
+    return {c: [r[i] for r in rows] for i, c in enumerate(names)}
+
+def next_match_id(matches):
+    return max([m['id'] for m in matches] or [0]) + 1
+
+# ============================================================================
+# STORAGE INTERFACE
+# ============================================================================
+
+class Storage:
+    """Where players, games and matches are kept"""
+
+    # True when cast_vote checks capacity and records the vote in one
+    # transaction the backend enforces, so other processes can't race it
+    atomic_votes = False
+
+    def load_players(self):
+        raise NotImplementedError
+
+    def save_players(self, players):
+        raise NotImplementedError
+
+    def load_games(self):
+        raise NotImplementedError
+
+    def save_games(self, games):
+        raise NotImplementedError
+
+    def append_vote(self, game_id, player, action):
+        """Add one event to the vote log"""
+        return self.append_votes([vote_row(game_id, player, action)])
+
+    def append_votes(self, rows):
+        """Add several VOTE_COLUMNS rows to the vote log"""
+        raise NotImplementedError
+
+    def cast_vote(self, game_id, player, action):
+        """Vote 'in' or 'out' of a game if that changes anything.
+
+        Returns ``(changed, votes)``: whether the vote was recorded, and the
+        game's votes afterwards.  'in' is refused when the game is full.
+        """
+        game = next((g for g in self.load_games() if g['id'] == game_id), None)
+        if game is None:
+            return False, []
+        changed = apply_vote(game, player, action)
+        if changed:
+            self.append_vote(game_id, player, action)
+        return changed, game['votes']
+
+    def clear_votes(self, game_id):
+        """Drop a deleted game's votes so a new game with its id starts empty"""
+        return self.append_vote(game_id, '', VOTE_CLEAR)
+
+    def load_archive(self):
+        """Past games moved out of the live list, oldest first"""
+        raise NotImplementedError
+
+    def load_history(self):
+        """(matches, appearance columns) from one read of the match tables"""
+        raise NotImplementedError
+
+    def load_many(self, names):
+        """Several datasets at once: 'players', 'games', 'archive' and/or 'matches' (the history)"""
+        loaders = {
+            'players': self.load_players,
+            'games': self.load_games,
+            'archive': self.load_archive,
+            'matches': self.load_history
+        }
+        return {name: loaders[name]() for name in names}
+
+    def load_matches(self):
+        return self.load_history()[0]
+
+    def load_appearances(self):
+        """One row per player per match, as a dict of APPEARANCE_COLUMNS lists"""
+        return self.load_history()[1]
+
+    def save_matches(self, matches):
+        raise NotImplementedError
+
+    def append_match(self, match):
+        """Record one new match without rewriting the others"""
+        raise NotImplementedError
+
+    def append_matches(self, matches):
+        """Record several new matches"""
+        for match in matches:
+            self.append_match(match)
+
+    def update_match(self, match):
+        """Replace the stored match that has ``match['id']``"""
+        raise NotImplementedError
+
+    def delete_match(self, match_id):
+        raise NotImplementedError
+
+    def compact_matches(self):
+        """Drop superseded match history, if the backend keeps any"""
+
+    def sync_status(self):
+        """(writes not stored yet, last write error) for backends that defer writes"""
+        return 0, None
+
+    def revision(self):
+        """Something that changes whenever the stored data does, or None if unknown"""
+        return None
+
+    def versions(self):
+        """{dataset: token} where a token changes whenever that dataset does, or None if untracked.
+
+        Writes to a backend that tracks them return the {dataset: token} they set.
+        """
+        return None
+
+    def watch_versions(self, callback):
+        """Have ``callback({dataset: token})`` called for writes this object sends later, in the background"""
+
+    def compact_matches_in_background(self):
+        """Run :meth:`compact_matches` on a daemon thread, one at a time"""
+        if not _compaction_running.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.compact_matches()
+            finally:
+                _compaction_running.release()
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+_compaction_running = threading.Lock()
+
+# ============================================================================
+# GOOGLE SHEETS
+# ============================================================================
+
+class SheetsStorage(Storage):
+    """League data in the Players, Games, Votes, Matches and Appearances worksheets.
+
+    ``spreadsheet`` is a gspread Spreadsheet or a
+    :class:`sheets_client.SheetsConnection`.
+    """
+
+    def __init__(self, spreadsheet):
+        from sheets_sync import SheetTable
+
+        self.spreadsheet = spreadsheet
+        self.players_table = SheetTable(spreadsheet.worksheet("Players"), PLAYER_COLUMNS)
+        self.matches_table = SheetTable(spreadsheet.worksheet("Matches"), MATCH_JOURNAL_COLUMNS)
+        self.games_table = SheetTable(spreadsheet.worksheet("Games"), GAME_COLUMNS)
+        self.appearances_table = SheetTable(spreadsheet.worksheet("Appearances"), APPEARANCE_COLUMNS)
+        self.votes_table = SheetTable(spreadsheet.worksheet("Votes"), VOTE_COLUMNS)
+        self.archive_table = SheetTable(spreadsheet.worksheet("GamesArchive"), GAME_COLUMNS)
+        self.versions_table = SheetTable(spreadsheet.worksheet("Versions"), VERSION_COLUMNS)
+        # Order table locks are taken in when several are held at once
+        self.lock_order = [
+            self.players_table, self.matches_table, self.appearances_table,
+            self.games_table, self.votes_table, self.archive_table, self.versions_table
+        ]
+
+    def _tables(self, name):
+        return {
+            'players': [self.players_table],
+            'games': [self.games_table, self.votes_table],
+            'archive': [self.archive_table, self.games_table, self.votes_table],
+            'matches': [self.matches_table, self.appearances_table]
+        }[name]
+
+    def _read(self, tables):
+        """{id(table): values} for ``tables``, in one batch_get request"""
+        tables = list(dict.fromkeys(tables))
+        for t in tables:
+            # A batch_get naming a tab that doesn't exist fails as a whole, and
+            # tables added since the sheet was set up (Votes, Appearances, ...)
+            # are only created when their worksheet is opened
+            t.open()
+        # Held across the read, as in SheetTable.fetch_values, so a write in
+        # this process can't land between it and the mirrors being replaced
+        with ExitStack() as held:
+            for t in sorted(tables, key=self.lock_order.index):
+                held.enter_context(t.lock)
+            response = self.spreadsheet.values_batch_get([f"'{t.worksheet.title}'" for t in tables])
+            return {
+                id(t): t.accept_values(vr.get('values', []))
+                for t, vr in zip(tables, response.get('valueRanges', []))
+            }
+
+    def _stored_games(self, values):
+        """(every game on the Games sheet with its votes, the vote log)"""
+        votes = self.votes_table.records(values[id(self.votes_table)])
+        games = fold_votes([decode_game(g) for g in self.games_table.records(values[id(self.games_table)])], votes)
+        return games, votes
+
+    def load_many(self, names):
+        """Read every table behind ``names`` in one batch_get request"""
+        values = self._read([t for name in names for t in self._tables(name)])
+
+        data = {}
+        for name in names:
+            if name == 'players':
+                data[name] = self.players_table.records(values[id(self.players_table)])
+            elif name == 'games':
+                data[name], _ = split_past_games(self._stored_games(values)[0])
+            elif name == 'archive':
+                # Past games not moved yet belong with the archived ones
+                _, past = split_past_games(self._stored_games(values)[0])
+                archived = [decode_game(g) for g in self.archive_table.records(values[id(self.archive_table)])]
+                data[name] = fold_archive(archived + past)
+            else:
+                data[name] = self._history(
+                    self.matches_table.records(values[id(self.matches_table)]),
+                    self.appearances_table.columns(values[id(self.appearances_table)])
+                )
+        return data
+
+    def _archive_past(self):
+        """Move games dated before today to GamesArchive; the ids moved"""
+        games, votes = self._stored_games(self._read([self.games_table, self.votes_table]))
+        _, past = split_past_games(games)
+        archived = {g['id'] for g in past}
+        if past:
+            with self.votes_table.lock:
+                self.archive_table.append_rows([game_row(g) for g in past])
+                # The archive row keeps the final votes; their events would only
+                # be replayed on every load, and onto a new game reusing the id
+                self.votes_table.write_rows([
+                    [r[c] for c in VOTE_COLUMNS] for r in votes if r['game_id'] not in archived
+                ])
+        return archived
+
+    def _touch(self, *datasets):
+        """Give ``datasets`` new version tokens: one small write"""
+        token = uuid.uuid4().hex[:16]
+        self.versions_table.update_rows({
+            VERSIONED_DATASETS.index(name): [name, token] for name in datasets
+        })
+        return {name: token for name in datasets}
+
+    def versions(self):
+        return {str(r['dataset']): str(r['version']) for r in self.versions_table.read_records()}
+
+    def _history(self, records, appearances):
+        # Teams left in teams_data would be parsed from JSON on every load
+        # until compaction moves them into Appearances
+        legacy = any(r.get('teams_data') for r in records)
+        matches, columns = build_history(records, appearances)
+        if legacy or len(records) - len(matches) > COMPACT_AFTER:
+            self.compact_matches_in_background()
+        return matches, columns
+
+    def load_players(self):
+        return self.players_table.read_records()
+
+    def save_players(self, players):
+        self.players_table.write_rows([player_row(p) for p in players])
+        return self._touch('players')
+
+    def load_games(self):
+        return self.load_many(['games'])['games']
+
+    def save_games(self, games):
+        with self.games_table.lock:
+            # Past games leave the sheet here, on a save, so loads stay read-only
+            archived = self._archive_past()
+            self.games_table.write_rows([game_row(g) for g in games if g['id'] not in archived])
+        # The archive as loaded is the GamesArchive sheet plus past games not
+        # moved yet; other processes only need to refetch it if either changed
+        _, past = split_past_games(games)
+        return self._touch('games', 'archive') if archived or past else self._touch('games')
+
+    def append_votes(self, rows):
+        self.votes_table.append_rows(rows)
+        return self._touch('games')
+
+    def load_archive(self):
+        return self.load_many(['archive'])['archive']
+
+    def revision(self):
+        fetch = getattr(self.spreadsheet, 'revision', None)
+        return fetch() if fetch is not None else None
+
+    def load_history(self):
+        return self.load_many(['matches'])['matches']
+
+    def save_matches(self, matches):
+        self.matches_table.write_rows([match_row(m) + [''] for m in matches])
+        self.appearances_table.write_rows([row for m in matches for row in appearance_rows(m)])
+        return self._touch('matches')
+
+    def append_match(self, match):
+        return self.append_matches([match])
+
+    def append_matches(self, matches):
+        # Same lock order as compact_matches, which mustn't run between the two appends
+        with self.matches_table.lock, self.appearances_table.lock:
+            self.appearances_table.append_rows([row for m in matches for row in appearance_rows(m)])
+            self.matches_table.append_rows([match_row(m) + [''] for m in matches])
+        return self._touch('matches')
+
+    def update_match(self, match):
+        # The later journal row wins when the sheet is read back; the match's
+        # appearances are replaced in a (rare) diff write of that table
+        with self.matches_table.lock, self.appearances_table.lock:
+            appearances = self.appearances_table.read_columns()
+            rows = [
+                [appearances[c][i] for c in APPEARANCE_COLUMNS]
+                for i, match_id in enumerate(appearances['match_id'])
+                if match_id != match['id']
+            ]
+            self.appearances_table.write_rows(rows + appearance_rows(match))
+            self.matches_table.append_rows([match_row(match) + ['']])
+        return self._touch('matches')
+
+    def delete_match(self, match_id):
+        self.matches_table.append_rows([[''] * (len(MATCH_COLUMNS) - 1) + [match_id, 1]])
+        return self._touch('matches')
+
+    def compact_matches(self):
+        """Rewrite the Matches sheet with one row per current match"""
+        with self.matches_table.lock, self.appearances_table.lock:
+            matches, _ = build_history(
+                self.matches_table.read_records(),
+                self.appearances_table.read_columns()
+            )
+            # Also moves matches recorded before the appearances table into it
+            return self.save_matches(matches)
+
+# ============================================================================
+# SQLITE
+# ============================================================================
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT NOT NULL,
+    rating INTEGER,
+    strength TEXT,
+    matches_played INTEGER,
+    matches_won INTEGER,
+    points INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_players_name ON players (name COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER NOT NULL,
+    date TEXT,
+    time TEXT,
+    location TEXT,
+    type TEXT,
+    max_players INTEGER,
+    votes TEXT,
+    created_by TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_games_id ON games (id);
+
+CREATE TABLE IF NOT EXISTS games_archive (
+    id INTEGER NOT NULL,
+    date TEXT,
+    time TEXT,
+    location TEXT,
+    type TEXT,
+    max_players INTEGER,
+    votes TEXT,
+    created_by TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_games_archive_date ON games_archive (date);
+
+CREATE TABLE IF NOT EXISTS votes (
+    game_id INTEGER NOT NULL,
+    player TEXT,
+    action TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_votes_game_id ON votes (game_id);
+
+CREATE TABLE IF NOT EXISTS matches (
+    date TEXT,
+    game_id INTEGER,
+    winner TEXT,
+    num_teams INTEGER,
+    teams_data TEXT,
+    id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_matches_date ON matches (date);
+CREATE INDEX IF NOT EXISTS idx_matches_game_id ON matches (game_id);
+
+CREATE TABLE IF NOT EXISTS appearances (
+    match_id INTEGER NOT NULL,
+    team TEXT,
+    player TEXT,
+    captain INTEGER,
+    winner INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_appearances_match_id ON appearances (match_id);
+CREATE INDEX IF NOT EXISTS idx_appearances_player ON appearances (player);
+"""
+
+# Indexes on columns that older databases only gain in _migrate
+SQLITE_INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_matches_id ON matches (id);
+"""
+
+
+class SQLiteStorage(Storage):
+    """League data in a local SQLite database file"""
+
+    atomic_votes = True
+
+    def __init__(self, path):
+        self.path = path
+        # Streamlit serves every session from its own thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(SQLITE_SCHEMA)
+            self._migrate()
+            self.conn.executescript(SQLITE_INDEXES)
+
+    def _migrate(self):
+        columns = [r['name'] for r in self.conn.execute("PRAGMA table_info(matches)")]
+        if 'id' not in columns:
+            # Databases created before matches had ids
+            self.conn.execute("ALTER TABLE matches ADD COLUMN id INTEGER")
+            self.conn.execute("UPDATE matches SET id = rowid")
+        # Matches recorded before the appearances table: move their teams into it
+        for r in self.conn.execute("SELECT id, winner, teams_data FROM matches WHERE teams_data != ''").fetchall():
+            match = {'id': r['id'], 'winner': r['winner'], 'teams': json.loads(r['teams_data'])}
+            self.conn.execute("DELETE FROM appearances WHERE match_id = ?", (r['id'],))
+            self._insert_appearances(match)
+            self.conn.execute("UPDATE matches SET teams_data = '' WHERE id = ?", (r['id'],))
+
+    def _select(self, table, columns):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid").fetchall()
+        return [dict(r) for r in rows]
+
+    def _replace(self, table, columns, rows):
+        placeholders = ', '.join('?' for _ in columns)
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM {table}")
+            self.conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                rows
+            )
+
+    def load_players(self):
+        return self._select('players', PLAYER_COLUMNS)
+
+    def save_players(self, players):
+        self._replace('players', PLAYER_COLUMNS, [player_row(p) for p in players])
+
+    def _stored_games(self):
+        return fold_votes(
+            [decode_game(g) for g in self._select('games', GAME_COLUMNS)],
+            self._select('votes', VOTE_COLUMNS)
+        )
+
+    def load_games(self):
+        live, _ = split_past_games(self._stored_games())
+        return live
+
+    def load_archive(self):
+        # Past games not moved yet belong with the archived ones
+        _, past = split_past_games(self._stored_games())
+        return fold_archive([decode_game(g) for g in self._select('games_archive', GAME_COLUMNS)] + past)
+
+    def save_games(self, games):
+        # Past games move to the archive here, on a save, so loads stay read-only
+        _, past = split_past_games(self._stored_games())
+        archived = {g['id'] for g in past}
+        placeholders = ', '.join('?' for _ in GAME_COLUMNS)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO games_archive ({', '.join(GAME_COLUMNS)}) VALUES ({placeholders})",
+                [game_row(g) for g in past]
+            )
+            # The archive row keeps the final votes; their events would only be
+            # replayed on every load, and onto a new game reusing the id
+            self.conn.executemany("DELETE FROM votes WHERE game_id = ?", [(i,) for i in archived])
+            self.conn.execute("DELETE FROM games")
+            self.conn.executemany(
+                f"INSERT INTO games ({', '.join(GAME_COLUMNS)}) VALUES ({placeholders})",
+                [game_row(g) for g in games if g['id'] not in archived]
+            )
+
+    def append_votes(self, rows):
+        with self.lock, self.conn:
+            self.conn.executemany(f"INSERT INTO votes ({', '.join(VOTE_COLUMNS)}) VALUES (?, ?, ?, ?)", rows)
+
+    def cast_vote(self, game_id, player, action):
+        # The capacity check and the insert share one write transaction, so
+        # other processes using the same file can't squeeze in between
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute(
+                    f"SELECT {', '.join(GAME_COLUMNS)} FROM games WHERE id = ?", (game_id,)
+                ).fetchall()
+                if not rows:
+                    self.conn.rollback()
+                    return False, []
+                events = self.conn.execute(
+                    f"SELECT {', '.join(VOTE_COLUMNS)} FROM votes WHERE game_id = ? ORDER BY rowid", (game_id,)
+                ).fetchall()
+                game = fold_votes([decode_game(dict(rows[0]))], [dict(e) for e in events])[0]
+                changed = apply_vote(game, player, action)
+                if changed:
+                    self.conn.execute(
+                        f"INSERT INTO votes ({', '.join(VOTE_COLUMNS)}) VALUES (?, ?, ?, ?)",
+                        vote_row(game_id, player, action)
+                    )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        return changed, game['votes']
+
+    def load_history(self):
+        records = self._select('matches', MATCH_COLUMNS)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(APPEARANCE_COLUMNS)} FROM appearances ORDER BY rowid"
+            ).fetchall()
+        return build_history(records, rows_to_columns(rows, APPEARANCE_COLUMNS))
+
+    def save_matches(self, matches):
+        self._replace('matches', MATCH_COLUMNS, [match_row(m) for m in matches])
+        self._replace('appearances', APPEARANCE_COLUMNS, [row for m in matches for row in appearance_rows(m)])
+
+    def _insert_appearances(self, match):
+        placeholders = ', '.join('?' for _ in APPEARANCE_COLUMNS)
+        self.conn.executemany(
+            f"INSERT INTO appearances ({', '.join(APPEARANCE_COLUMNS)}) VALUES ({placeholders})",
+            appearance_rows(match)
+        )
+
+    def append_match(self, match):
+        placeholders = ', '.join('?' for _ in MATCH_COLUMNS)
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT INTO matches ({', '.join(MATCH_COLUMNS)}) VALUES ({placeholders})",
+                match_row(match)
+            )
+            self._insert_appearances(match)
+
+    def update_match(self, match):
+        assignments = ', '.join(f"{c} = ?" for c in MATCH_COLUMNS)
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"UPDATE matches SET {assignments} WHERE id = ?",
+                match_row(match) + [match['id']]
+            )
+            self.conn.execute("DELETE FROM appearances WHERE match_id = ?", (match['id'],))
+            self._insert_appearances(match)
+
+    def delete_match(self, match_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM matches WHERE id = ?", (match_id,))
+            self.conn.execute("DELETE FROM appearances WHERE match_id = ?", (match_id,))
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+def storage_config(secrets=None):
+    """Storage settings from the ``[storage]`` secrets section and environment"""
+    config = {
+        'backend': 'sheets',
+        'sqlite_path': 'league.db',
+        'sheet_id': SHEET_ID,
+        'cache_ttl': 60,
+        'write_behind': None,
+        'wal_path': 'league.wal',
+        'snapshot': None,
+        'snapshot_dir': '.league_snapshot',
+        'api_port': None,
+        'api_host': '127.0.0.1'
+    }
+    if secrets is not None:
+        try:
+            config.update(secrets.get("storage", {}))
+        except FileNotFoundError:
+            # No secrets.toml, e.g. when running offline
+            pass
+    env = {
+        'backend': os.environ.get('LEAGUE_STORAGE'),
+        'sqlite_path': os.environ.get('LEAGUE_DB_PATH'),
+        'sheet_id': os.environ.get('LEAGUE_SHEET_ID'),
+        'cache_ttl': os.environ.get('LEAGUE_CACHE_TTL'),
+        'write_behind': os.environ.get('LEAGUE_WRITE_BEHIND'),
+        'wal_path': os.environ.get('LEAGUE_WAL_PATH'),
+        'snapshot': os.environ.get('LEAGUE_SNAPSHOT'),
+        'snapshot_dir': os.environ.get('LEAGUE_SNAPSHOT_DIR'),
+        'api_port': os.environ.get('LEAGUE_API_PORT'),
+        'api_host': os.environ.get('LEAGUE_API_HOST'),
+    }
+    config.update({k: v for k, v in env.items() if v})
+    config['cache_ttl'] = float(config['cache_ttl'])
+    if config['api_port']:
+        config['api_port'] = int(config['api_port'])
+    # Both are worth it for the slow Sheets API; SQLite is local already
+    for flag in ('write_behind', 'snapshot'):
+        if config[flag] is None:
+            config[flag] = config['backend'] == 'sheets'
+        elif isinstance(config[flag], str):
+            config[flag] = config[flag].lower() in ('1', 'true', 'yes', 'on')
+    return config
+
+
+def open_storage(config, credentials_info=None):
+    """Create the backend named in ``config``, with the snapshot and write-behind layers enabled there"""
+    if config['backend'] == 'sqlite':
+        store = SQLiteStorage(config['sqlite_path'])
+    elif config['backend'] == 'sheets':
+        from sheets_client import get_connection
+
+        # Nothing is fetched until the first load or save
+        store = SheetsStorage(get_connection(config['sheet_id'], credentials_info))
+    else:
+        raise ValueError(f"Unknown storage backend: {config['backend']}")
+
+    if config.get('snapshot'):
+        from snapshot import SnapshotStorage
+
+        store = SnapshotStorage(store, config['snapshot_dir'])
+
+    # Above the snapshot, so a load flushes queued writes before checking the revision
+    if config.get('write_behind'):
+        from write_behind import WriteBehindStorage
+
+        store = WriteBehindStorage(store, config['wal_path'])
+    return store
@@ -0,0 +1,371 @@
+"""Balanced team generation.
+
+Splits the players who voted for a game into 2-4 teams of equal size (within
+one player) so that:
+
+1. every role (``strength``) is spread as evenly as possible, so two wicket
+   keepers never end up on one team while another has none;
+2. the gap between the strongest and weakest team total is as small as
+   possible.
+
+Small squads are searched exhaustively.  Larger ones start from a role-aware
+greedy split and are improved by swapping and moving players between teams,
+with random restarts until the time budget runs out.
+
+:func:`team_options` also looks at match history.  It deals thousands of
+role-balanced random splits at once, improves them all together with NumPy
+(every step tries one same-role swap in each split), and scores each on
+rating spread plus how often its teammates have already played together.
+One of those splits is :func:`balance_teams`' own, so the best option never
+scores worse than it.  The best few distinct splits are offered to the
+admin, so the same core players don't end up together every week.
+"""
+
+import random
+import time
+from math import factorial
+
+import numpy as np
+
+# Squads with at most this many distinct splits are solved exactly
+EXACT_MAX_SPLITS = 3000
+
+# Seconds to spend improving larger squads
+TIME_BUDGET = 0.06
+
+# Splits improved side by side by team_options, and the swap steps they get
+CANDIDATES = 2000
+IMPROVE_ROUNDS = 200
+
+# Rating points of spread worth the same as one repeated teammate pairing
+NOVELTY_WEIGHT = 1.0
+
+# Matches after which a past pairing counts half as much
+HISTORY_HALF_LIFE = 10
+
+# Splits offered to the admin
+TOP_OPTIONS = 3
+
+
+def team_sizes(num_players, num_teams):
+    """Sizes that differ by at most one, largest first"""
+    base, extra = divmod(num_players, num_teams)
+    return [base + 1 if i < extra else base for i in range(num_teams)]
+
+
+def count_splits(num_players, num_teams):
+    """Distinct ways to split the squad, ignoring team order"""
+    sizes = team_sizes(num_players, num_teams)
+    count = factorial(num_players)
+    for size in sizes:
+        count //= factorial(size)
+    for size in set(sizes):
+        count //= factorial(sizes.count(size))
+    return count
+
+
+class _Split:
+    """Team assignment with running totals, cheap to score after a change"""
+
+    def __init__(self, ratings, roles, num_roles, num_teams, assignment):
+        self.ratings = ratings
+        self.roles = roles
+        self.assignment = list(assignment)
+        self.totals = [0] * num_teams
+        self.role_counts = [[0] * num_roles for _ in range(num_teams)]
+        self.members = [[] for _ in range(num_teams)]
+        for p, t in enumerate(assignment):
+            self.totals[t] += ratings[p]
+            self.role_counts[t][roles[p]] += 1
+            self.members[t].append(p)
+
+    def cost(self):
+        """(role imbalance, rating spread, total deviation from the mean); lower is better"""
+        role_excess = 0
+        for r in range(len(self.role_counts[0])):
+            counts = [c[r] for c in self.role_counts]
+            role_excess += max(0, max(counts) - min(counts) - 1)
+        mean = sum(self.totals) / len(self.totals)
+        return (
+            role_excess,
+            max(self.totals) - min(self.totals),
+            sum(abs(t - mean) for t in self.totals)
+        )
+
+    def move(self, p, dest):
+        src = self.assignment[p]
+        self.totals[src] -= self.ratings[p]
+        self.totals[dest] += self.ratings[p]
+        self.role_counts[src][self.roles[p]] -= 1
+        self.role_counts[dest][self.roles[p]] += 1
+        self.members[src].remove(p)
+        self.members[dest].append(p)
+        self.assignment[p] = dest
+
+
+def _greedy(ratings, roles, num_teams, order):
+    """Rarest roles first, each player to the team with fewest of that role, then weakest"""
+    sizes = team_sizes(len(ratings), num_teams)
+    role_freq = {}
+    for r in roles:
+        role_freq[r] = role_freq.get(r, 0) + 1
+
+    assignment = [0] * len(ratings)
+    counts = {}
+    totals = [0] * num_teams
+    filled = [0] * num_teams
+    for p in sorted(order, key=lambda p: (role_freq[roles[p]], -ratings[p])):
+        open_teams = [t for t in range(num_teams) if filled[t] < sizes[t]]
+        t = min(open_teams, key=lambda t: (counts.get((t, roles[p]), 0), totals[t], filled[t]))
+        assignment[p] = t
+        counts[(t, roles[p])] = counts.get((t, roles[p]), 0) + 1
+        totals[t] += ratings[p]
+        filled[t] += 1
+    return assignment
+
+
+def _local_search(split, deadline):
+    """Apply the best improving swap or move until none is left"""
+    num_teams = len(split.totals)
+    best = split.cost()
+    while time.perf_counter() < deadline:
+        best_change = None
+        for a in range(num_teams):
+            for b in range(a + 1, num_teams):
+                size_gap = len(split.members[a]) - len(split.members[b])
+                for p in list(split.members[a]):
+                    # Moving keeps sizes within one only from the larger team
+                    if size_gap == 1:
+                        split.move(p, b)
+                        c = split.cost()
+                        split.move(p, a)
+                        if c < best:
+                            best, best_change = c, ((p, b),)
+                    for q in list(split.members[b]):
+                        if split.ratings[p] == split.ratings[q] and split.roles[p] == split.roles[q]:
+                            continue
+                        split.move(p, b)
+                        split.move(q, a)
+                        c = split.cost()
+                        split.move(q, b)
+                        split.move(p, a)
+                        if c < best:
+                            best, best_change = c, ((p, b), (q, a))
+                if size_gap == -1:
+                    for q in list(split.members[b]):
+                        split.move(q, a)
+                        c = split.cost()
+                        split.move(q, b)
+                        if c < best:
+                            best, best_change = c, ((q, a),)
+        if best_change is None:
+            break
+        for p, dest in best_change:
+            split.move(p, dest)
+    return best
+
+
+def _exact(ratings, roles, num_roles, num_teams, deadline):
+    """Try every split of a small squad, skipping relabelled duplicates"""
+    n = len(ratings)
+    sizes = sorted(team_sizes(n, num_teams), reverse=True)
+    order = sorted(range(n), key=lambda p: -ratings[p])
+    assignment = [0] * n
+    filled = [0] * num_teams
+    best = [None, None]
+
+    def place(i):
+        if time.perf_counter() > deadline:
+            return
+        if i == n:
+            split = _Split(ratings, roles, num_roles, num_teams, assignment)
+            c = split.cost()
+            if best[0] is None or c < best[0]:
+                best[0], best[1] = c, list(assignment)
+            return
+        p = order[i]
+        tried_empty = set()
+        for t in range(num_teams):
+            if filled[t] >= sizes[t]:
+                continue
+            # Empty teams of the same size are interchangeable
+            if filled[t] == 0:
+                if sizes[t] in tried_empty:
+                    continue
+                tried_empty.add(sizes[t])
+            assignment[p] = t
+            filled[t] += 1
+            place(i + 1)
+            filled[t] -= 1
+            if best[0] is not None and best[0][:2] == (0, 0):
+                return
+
+    place(0)
+    return best[1]
+
+
+def balance_teams(players, num_teams, time_budget=TIME_BUDGET, seed=None):
+    """Split ``players`` into ``num_teams`` balanced teams.
+
+    Returns a list of teams, each a list of the player dicts sorted by rating.
+    """
+    deadline = time.perf_counter() + time_budget
+    ratings = [p['rating'] for p in players]
+    role_ids = {}
+    roles = [role_ids.setdefault(p['strength'], len(role_ids)) for p in players]
+    num_roles = max(len(role_ids), 1)
+
+    assignment = None
+    if count_splits(len(players), num_teams) <= EXACT_MAX_SPLITS:
+        assignment = _exact(ratings, roles, num_roles, num_teams, deadline)
+
+    if assignment is None:
+        rng = random.Random(seed)
+        order = list(range(len(players)))
+        best_split = _Split(ratings, roles, num_roles, num_teams, _greedy(ratings, roles, num_teams, order))
+        best_cost = _local_search(best_split, deadline)
+        # Restart from shuffled greedy splits while there is time left
+        while time.perf_counter() < deadline and best_cost[:2] != (0, 0):
+            rng.shuffle(order)
+            start = _greedy(ratings, roles, num_teams, order)
+            for _ in range(len(players) // 4):
+                a, b = rng.sample(range(len(players)), 2)
+                start[a], start[b] = start[b], start[a]
+            split = _Split(ratings, roles, num_roles, num_teams, start)
+            cost = _local_search(split, deadline)
+            if cost < best_cost:
+                best_split, best_cost = split, cost
+        assignment = best_split.assignment
+
+    teams = [[] for _ in range(num_teams)]
+    for p, t in enumerate(assignment):
+        teams[t].append(players[p])
+    return [sorted(team, key=lambda x: x['rating'], reverse=True) for team in teams]
+
+# ============================================================================
+# HISTORY-AWARE OPTIONS
+# ============================================================================
+
+def pairing_counts(matches, names, half_life=HISTORY_HALF_LIFE):
+    """Square array: how often each two of ``names`` were teammates, recent matches weighing more"""
+    index = {name: i for i, name in enumerate(names)}
+    groups, weights = [], []
+    # Matches are stored oldest first
+    for age, match in enumerate(reversed(matches)):
+        for team in match['teams']:
+            members = [index[name] for name in team['players'] if name in index]
+            if len(members) > 1:
+                groups.append(members)
+                weights.append(0.5 ** (age / half_life))
+    incidence = np.zeros((len(groups), len(names)))
+    for g, members in enumerate(groups):
+        incidence[g, members] = 1
+    counts = (incidence * np.array(weights)[:, None]).T @ incidence if groups else incidence.T @ incidence
+    np.fill_diagonal(counts, 0)
+    return counts
+
+
+def _deal(roles, num_teams, num_candidates, rng):
+    """Random assignments, one row each, with team sizes and every role spread within one"""
+    n = len(roles)
+    num_roles = roles.max() + 1
+    # Players grouped by role (roles and players in random order), then dealt round-robin
+    role_order = rng.permuted(np.tile(np.arange(num_roles), (num_candidates, 1)), axis=1)
+    keys = np.take_along_axis(role_order, np.tile(roles, (num_candidates, 1)), axis=1) + rng.random((num_candidates, n))
+    order = np.argsort(keys, axis=1)
+    seats = (np.arange(n)[None, :] + rng.integers(num_teams, size=(num_candidates, 1))) % num_teams
+    assignment = np.empty((num_candidates, n), dtype=np.intp)
+    np.put_along_axis(assignment, order, seats, axis=1)
+    return assignment
+
+
+def _canonical(assignment):
+    """Team labels renumbered by first player, so relabelled duplicates compare equal"""
+    labels = {}
+    return tuple(labels.setdefault(t, len(labels)) for t in assignment)
+
+
+def team_options(players, num_teams, pairings=None, count=TOP_OPTIONS, novelty=NOVELTY_WEIGHT,
+                 candidates=CANDIDATES, rounds=IMPROVE_ROUNDS, seed=None):
+    """The ``count`` best distinct splits of ``players``, best first.
+
+    ``pairings`` comes from :func:`pairing_counts` for the same players; leave
+    it out to score on rating spread alone.  Each option is a dict with
+    ``teams`` (lists of player dicts, as :func:`balance_teams` returns),
+    ``strengths``, ``spread`` and ``repeats`` (weighted past pairings).
+
+    The first option's spread plus weighted repeats is at most that of the
+    :func:`balance_teams` split, which is always among the candidates.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(players)
+    ratings = np.array([p['rating'] for p in players], dtype=float)
+    role_ids = {}
+    roles = np.array([role_ids.setdefault(p['strength'], len(role_ids)) for p in players], dtype=np.intp)
+    if pairings is None:
+        pairings = np.zeros((n, n))
+
+    assignment = _deal(roles, num_teams, candidates, rng)
+    # Swaps only ever lower a candidate's score, so starting one from the
+    # balanced split keeps the search from doing worse than it
+    position = {id(p): i for i, p in enumerate(players)}
+    for t, team in enumerate(balance_teams(players, num_teams, seed=seed)):
+        assignment[0, [position[id(p)] for p in team]] = t
+    rows = np.arange(candidates)
+    members = (assignment[:, :, None] == np.arange(num_teams)).astype(float)
+    totals = np.einsum('knt,n->kt', members, ratings)
+    # together[k, i, t]: past pairings between player i and the members of team t
+    together = np.einsum('ij,kjt->kit', pairings, members)
+    repeats = 0.5 * np.einsum('kit,kit->k', members, together)
+    score = np.ptp(totals, axis=1) + novelty * repeats
+
+    # Swap partners: players with the same role, so sizes and roles stay balanced
+    same_role = [np.flatnonzero(roles == roles[p]) for p in range(n)]
+    partner_count = np.array([len(s) for s in same_role])
+    partners = np.zeros((n, partner_count.max()), dtype=np.intp)
+    for p, s in enumerate(same_role):
+        partners[p, :len(s)] = s
+
+    for _ in range(rounds):
+        p = rng.integers(n, size=candidates)
+        q = partners[p, (rng.random(candidates) * partner_count[p]).astype(np.intp)]
+        a = assignment[rows, p]
+        b = assignment[rows, q]
+        new_totals = totals.copy()
+        new_totals[rows, a] += ratings[q] - ratings[p]
+        new_totals[rows, b] += ratings[p] - ratings[q]
+        change = (together[rows, p, b] - together[rows, p, a] - pairings[p, q]
+                  + together[rows, q, a] - together[rows, q, b] - pairings[q, p])
+        new_score = np.ptp(new_totals, axis=1) + novelty * (repeats + change)
+        accept = (a != b) & (new_score < score)
+        if not accept.any():
+            continue
+        k, p, q, a, b = rows[accept], p[accept], q[accept], a[accept], b[accept]
+        assignment[k, p] = b
+        assignment[k, q] = a
+        totals[k] = new_totals[k]
+        repeats[k] += change[accept]
+        score[k] = new_score[accept]
+        together[k, :, a] += (pairings[:, q] - pairings[:, p]).T
+        together[k, :, b] += (pairings[:, p] - pairings[:, q]).T
+
+    options, seen = [], set()
+    for k in np.argsort(score, kind='stable'):
+        key = _canonical(assignment[k])
+        if key in seen:
+            continue
+        seen.add(key)
+        teams = [[] for _ in range(num_teams)]
+        for player, t in zip(players, assignment[k]):
+            teams[t].append(player)
+        teams = [sorted(team, key=lambda x: x['rating'], reverse=True) for team in teams]
+        options.append({
+            'teams': teams,
+            # Ratings carry one decimal; rounding drops the float noise from summing them
+            'strengths': [round(sum(p['rating'] for p in team), 1) for team in teams],
+            'spread': round(float(np.ptp(totals[k])), 1),
+            'repeats': float(repeats[k])
+        })
+        if len(options) == count:
+            break
+    return options
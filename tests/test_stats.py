@@ -0,0 +1,96 @@
+"""Window totals from the date index against a scan of the matches"""
+
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from stats import LeagueStats
+
+NAMES = [f'P{i}' for i in range(10)]
+
+
+def random_matches(rng, count, first_id=1, start=date(2023, 11, 1)):
+    matches = []
+    for i in range(count):
+        players = rng.sample(NAMES, 6)
+        # Undated matches count in the totals but in no window
+        day = 'not a date' if rng.random() < 0.05 else str(start + timedelta(days=rng.randrange(120)))
+        matches.append({
+            'id': first_id + i,
+            'date': day,
+            'winner': rng.choice(['A', 'B']),
+            'teams': [
+                {'name': 'A', 'captain': players[0], 'players': players[:3]},
+                {'name': 'B', 'captain': players[3], 'players': players[3:]}
+            ]
+        })
+    return matches
+
+
+def scan(matches, lo, hi):
+    """{player: (played, won)} over ranks lo..hi, ranking dated matches by (date, id)"""
+    dated = sorted((m for m in matches if m['date'] != 'not a date'), key=lambda m: (m['date'], m['id']))
+    totals = {}
+    for m in dated[lo:hi]:
+        for team in m['teams']:
+            for name in team['players']:
+                played, won = totals.get(name, (0, 0))
+                totals[name] = (played + 1, won + (team['name'] == m['winner']))
+    return totals
+
+
+def windows(stats, rng):
+    count = len(stats.match_days)
+    yield stats.season(2023)
+    yield stats.season(2024)
+    yield stats.month(2024, 1)
+    yield stats.match_range(date(2023, 12, 24), date(2024, 1, 7))
+    yield stats.last_matches(7)
+    yield stats.last_matches(count + 5)
+    for _ in range(6):
+        lo = rng.randrange(count + 1)
+        yield lo, rng.randrange(lo, count + 1)
+
+
+def assert_windows_match(stats, matches, rng):
+    for lo, hi in windows(stats, rng):
+        totals = stats.window_totals((lo, hi))
+        found = {name: (row['matches_played'], row['matches_won']) for name, row in totals.iterrows()}
+        assert found == scan(matches, lo, hi), (lo, hi)
+        assert (totals['points'] == totals['matches_won']).all()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_window_totals_match_a_scan(seed):
+    rng = random.Random(seed)
+    matches = random_matches(rng, 60)
+    assert_windows_match(LeagueStats(matches), matches, rng)
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_window_totals_after_appending(seed):
+    rng = random.Random(seed)
+    matches = random_matches(rng, 40)
+    stats = LeagueStats(matches)
+    for i in range(8):
+        last = max(m['date'] for m in matches if m['date'] != 'not a date')
+        new = random_matches(rng, 1, first_id=100 + i, start=date.fromisoformat(last) + timedelta(days=1))
+        matches = matches + new
+        stats = stats.updated(matches) or LeagueStats(matches)
+        assert_windows_match(stats, matches, rng)
+    assert stats.tail, "every match above should have been appended, not rebuilt"
+
+
+def test_match_dated_before_the_index_needs_a_rebuild():
+    rng = random.Random(1)
+    matches = random_matches(rng, 20, start=date(2024, 1, 1))
+    early = random_matches(rng, 1, first_id=50, start=date(2020, 1, 1))
+    assert LeagueStats(matches).updated(matches + early) is None
+
+
+def test_edited_history_needs_a_rebuild():
+    rng = random.Random(2)
+    matches = random_matches(rng, 20)
+    edited = [dict(m) for m in matches]
+    assert LeagueStats(matches).updated(edited) is None
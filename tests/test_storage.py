@@ -0,0 +1,86 @@
+"""Replaying the match journal and the vote log"""
+
+from storage import (
+    MATCH_JOURNAL_COLUMNS, VOTE_CLEAR, VOTE_IN, VOTE_OUT, build_history, fold_matches, fold_votes
+)
+
+
+def journal_row(match_id, winner='A', deleted=''):
+    row = dict.fromkeys(MATCH_JOURNAL_COLUMNS, '')
+    if not deleted:
+        row.update(date='2024-01-01', game_id=1, winner=winner, num_teams=2)
+    row.update(id=match_id, deleted=deleted)
+    return row
+
+
+def vote(game_id, player, action):
+    return {'game_id': game_id, 'player': player, 'action': action, 'timestamp': ''}
+
+
+def test_fold_matches_later_row_wins():
+    matches = fold_matches([journal_row(1, 'A'), journal_row(2, 'A'), journal_row(1, 'B')])
+    assert [(m['id'], m['winner']) for m in matches] == [(1, 'B'), (2, 'A')]
+
+
+def test_fold_matches_drops_deleted():
+    matches = fold_matches([journal_row(1), journal_row(2), journal_row(1, deleted=1)])
+    assert [m['id'] for m in matches] == [2]
+    assert all('deleted' not in m for m in matches)
+
+
+def test_fold_matches_numbers_rows_without_id_by_position():
+    rows = [journal_row(''), journal_row('')]
+    assert [m['id'] for m in fold_matches(rows)] == [1, 2]
+
+
+def test_build_history_keeps_appearances_of_live_matches_only():
+    records = [journal_row(1, 'A'), journal_row(2, 'B'), journal_row(2, deleted=1)]
+    appearances = {
+        'match_id': [1, 1, 2],
+        'team': ['A', 'B', 'A'],
+        'player': ['Ali', 'Bob', 'Cy'],
+        'captain': [1, 1, 1],
+        'winner': [1, 0, 0]
+    }
+    matches, columns = build_history(records, appearances)
+    assert [m['id'] for m in matches] == [1]
+    assert matches[0]['teams'] == [
+        {'name': 'A', 'captain': 'Ali', 'players': ['Ali']},
+        {'name': 'B', 'captain': 'Bob', 'players': ['Bob']}
+    ]
+    assert columns['player'] == ['Ali', 'Bob']
+
+
+def test_fold_votes_replays_in_order():
+    games = [{'id': 1, 'max_players': 5, 'votes': ['Ali']}]
+    log = [vote(1, 'Bob', VOTE_IN), vote(1, 'ali', VOTE_OUT), vote(1, 'Bob', VOTE_IN), vote(2, 'Cy', VOTE_IN)]
+    assert fold_votes(games, log)[0]['votes'] == ['Bob']
+
+
+def test_fold_votes_refuses_ins_past_capacity():
+    games = [{'id': 1, 'max_players': 2, 'votes': []}]
+    log = [vote(1, name, VOTE_IN) for name in ['Ali', 'Bob', 'Cy']] + [vote(1, 'Ali', VOTE_OUT), vote(1, 'Dan', VOTE_IN)]
+    assert fold_votes(games, log)[0]['votes'] == ['Bob', 'Dan']
+
+
+def test_fold_votes_clear_empties_a_reused_game():
+    games = [{'id': 1, 'max_players': 5, 'votes': ['Ali', 'Bob']}]
+    log = [vote(1, '', VOTE_CLEAR), vote(1, 'Cy', VOTE_IN)]
+    assert fold_votes(games, log)[0]['votes'] == ['Cy']
+
+
+def test_saving_games_touches_the_archive_only_when_games_moved():
+    from fake_sheets import FakeSpreadsheet
+    from storage import SheetsStorage
+
+    store = SheetsStorage(FakeSpreadsheet())
+    game = {'id': 1, 'date': '2999-01-01', 'time': '10:00', 'location': 'Park', 'type': 'Internal',
+            'max_players': 10, 'votes': [], 'created_by': 'Admin'}
+    assert set(store.save_games([game])) == {'games'}
+    assert set(store.save_games([game])) == {'games'}
+    # A past game shows in the archive as soon as it is saved, and moves there on the next save
+    past = dict(game, id=2, date='2000-01-01')
+    assert set(store.save_games([game, past])) == {'games', 'archive'}
+    assert set(store.save_games([game])) == {'games', 'archive'}
+    assert set(store.save_games([game])) == {'games'}
+    assert [g['id'] for g in store.load_archive()] == [2]
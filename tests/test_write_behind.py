@@ -0,0 +1,186 @@
+"""Planning flushes, setting aside writes that keep failing, and reading through the queue"""
+
+import copy
+import json
+
+import pytest
+
+import write_behind
+from fake_sheets import FakeSpreadsheet
+from storage import VOTE_IN, VOTE_OUT, SheetsStorage, vote_row
+from write_behind import WriteBehindStorage, apply_pending, coalesce
+
+
+def op(seq, method, *args):
+    return {'seq': seq, 'method': method, 'args': list(args)}
+
+
+def player(name, rating=5):
+    return {'name': name, 'rating': rating, 'strength': 'Batsman', 'matches_played': 0, 'matches_won': 0, 'points': 0}
+
+
+def match(match_id, winner='A'):
+    return {
+        'id': match_id, 'date': '2024-01-01', 'game_id': 1, 'winner': winner, 'num_teams': 2,
+        'teams': [
+            {'name': 'A', 'captain': f'a{match_id}', 'players': [f'a{match_id}']},
+            {'name': 'B', 'captain': f'b{match_id}', 'players': [f'b{match_id}']}
+        ]
+    }
+
+
+@pytest.fixture
+def backend():
+    return SheetsStorage(FakeSpreadsheet())
+
+
+@pytest.fixture
+def queued(backend, tmp_path):
+    # A window long enough that only the test flushes
+    return WriteBehindStorage(backend, str(tmp_path / 'league.wal'), window=3600)
+
+# ============================================================================
+# COALESCING
+# ============================================================================
+
+def test_coalesce_drops_saves_before_the_last_full_save():
+    ops = [
+        op(1, 'save_players', [player('Ali')]),
+        op(2, 'append_votes', [vote_row(1, 'Ali', VOTE_IN)]),
+        op(3, 'save_players', [player('Bob')]),
+    ]
+    assert coalesce(ops) == [
+        ('append_votes', [[vote_row(1, 'Ali', VOTE_IN)]], [2]),
+        ('save_players', [[player('Bob')]], [1, 3]),
+    ]
+
+
+def test_coalesce_merges_back_to_back_appends_only():
+    ops = [
+        op(1, 'append_matches', [match(1)]),
+        op(2, 'append_matches', [match(2)]),
+        op(3, 'update_match', match(1, 'B')),
+        op(4, 'append_matches', [match(3)]),
+    ]
+    assert [(method, seqs) for method, _, seqs in coalesce(ops)] == [
+        ('append_matches', [1, 2]),
+        ('update_match', [3]),
+        ('append_matches', [4]),
+    ]
+    assert [m['id'] for m in coalesce(ops)[0][1][0]] == [1, 2]
+
+
+def test_coalesce_leaves_the_ops_unchanged():
+    ops = [op(1, 'append_matches', [match(1)]), op(2, 'append_matches', [match(2)])]
+    before = copy.deepcopy(ops)
+    coalesce(ops)
+    assert ops == before
+
+# ============================================================================
+# FAILING FLUSHES
+# ============================================================================
+
+def test_write_failing_max_attempts_is_set_aside(backend, queued, monkeypatch):
+    monkeypatch.setattr(write_behind, 'MAX_ATTEMPTS', 3)
+
+    def broken(matches):
+        raise ConnectionError("sheet unreachable")
+
+    monkeypatch.setattr(backend, 'append_matches', broken)
+    queued.append_match(match(1))
+    queued.save_players([player('Ali')])
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            queued.flush()
+        assert queued.sync_status()[0] == 2
+    with pytest.raises(ConnectionError):
+        queued.flush()
+
+    # Out of the queue and the log, kept in the .failed file
+    assert [o['method'] for o in queued.ops] == ['save_players']
+    with open(queued.failed_path) as f:
+        failed = [json.loads(line) for line in f]
+    assert [(o['method'], o['attempts']) for o in failed] == [('append_matches', 3)]
+    assert 'sheet unreachable' in failed[0]['error']
+    with open(queued.wal_path) as f:
+        assert [json.loads(line)['method'] for line in f] == ['save_players']
+
+    # What was queued behind it goes through, and the loss stays reported
+    queued.flush()
+    assert [p['name'] for p in backend.load_players()] == ['Ali']
+    pending, error = queued.sync_status()
+    assert pending == 0 and 'set aside' in str(error)
+
+
+def test_attempts_survive_a_restart(backend, queued, tmp_path, monkeypatch):
+    def broken(players):
+        raise ConnectionError("sheet unreachable")
+
+    monkeypatch.setattr(backend, 'save_players', broken)
+    queued.save_players([player('Ali')])
+    with pytest.raises(ConnectionError):
+        queued.flush()
+
+    reopened = WriteBehindStorage(backend, queued.wal_path, window=3600)
+    assert [o.get('attempts') for o in reopened.ops] == [1]
+
+
+def test_reads_see_queued_writes_while_flushes_fail(backend, queued, monkeypatch):
+    def broken(*args):
+        raise ConnectionError("sheet unreachable")
+
+    monkeypatch.setattr(backend, 'save_players', broken)
+    queued.save_players([player('Ali'), player('Bob')])
+    queued.append_match(match(1))
+    with pytest.raises(ConnectionError):
+        queued.flush()
+
+    assert [p['name'] for p in queued.load_players()] == ['Ali', 'Bob']
+    assert [m['id'] for m in queued.load_matches()] == [1]
+
+# ============================================================================
+# READING THROUGH THE QUEUE
+# ============================================================================
+
+def apply_twice(name, data, ops):
+    once = apply_pending(name, copy.deepcopy(data), ops)
+    twice = apply_pending(name, copy.deepcopy(once), ops)
+    return once, twice
+
+
+def test_apply_pending_players_is_idempotent():
+    once, twice = apply_twice('players', [player('Ali')], [op(1, 'save_players', [player('Bob')])])
+    assert once == twice == [player('Bob')]
+
+
+def test_apply_pending_votes_is_idempotent():
+    games = [{'id': 1, 'date': '2999-01-01', 'max_players': 2, 'votes': ['Ali']}]
+    ops = [op(1, 'append_votes', [vote_row(1, 'Bob', VOTE_IN), vote_row(1, 'Ali', VOTE_OUT), vote_row(1, 'Cy', VOTE_IN)])]
+    once, twice = apply_twice('games', games, ops)
+    assert once == twice
+    assert once[0]['votes'] == ['Bob', 'Cy']
+
+
+def test_apply_pending_matches_is_idempotent(backend):
+    backend.save_matches([match(1), match(2)])
+    ops = [
+        op(1, 'append_matches', [match(3), match(4)]),
+        op(2, 'update_match', match(1, 'B')),
+        op(3, 'delete_match', 2),
+    ]
+    once, twice = apply_twice('matches', backend.load_history(), ops)
+    assert once == twice
+    assert [(m['id'], m['winner']) for m in once[0]] == [(1, 'B'), (3, 'A'), (4, 'A')]
+    assert sorted(set(once[1]['match_id'])) == [1, 3, 4]
+
+
+def test_apply_pending_after_the_flush_landed(backend, queued):
+    # The read raced the flush: the backend already has the writes still listed
+    queued.append_match(match(1))
+    queued.update_match(match(1, 'B'))
+    ops = list(queued.ops)
+    queued.flush()
+    history = apply_pending('matches', backend.load_history(), ops)
+    assert [(m['id'], m['winner']) for m in history[0]] == [(1, 'B')]
+    assert history[1]['player'] == ['a1', 'b1']
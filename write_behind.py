@@ -0,0 +1,315 @@
+"""Write-behind queue in front of a storage backend.
+
+Every button that changed something used to wait for Google before the page
+could rerun.  :class:`WriteBehindStorage` appends each write to a local
+write-ahead log (one fsynced JSON line) and returns at once; the cache above
+it already holds the new data.  A background thread lets writes pile up for
+``window`` seconds, drops saves made redundant by a later full save of the
+same dataset, merges runs of appends into one request and sends the rest.
+
+Writes still in the log when the process dies are sent after the next start.
+Reads never wait for a flush: the writes still queued are applied on top of
+what the backend returns, so they always see every write made before them,
+even while the backend is failing.  A write the backend rejects
+``MAX_ATTEMPTS`` times in a row is moved to a ``.failed`` file next to the
+log rather than blocking everything queued behind it.
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+
+from diagnostics import PROFILER
+from storage import (
+    APPEARANCE_COLUMNS, VOTE_COLUMNS, Storage, appearance_rows, fold_votes, rows_to_columns, split_past_games
+)
+
+# Seconds a write waits for others to join the same flush
+FLUSH_WINDOW = 2.0
+
+# Delay before retrying a failed flush, doubled each time up to RETRY_CAP
+RETRY_BASE = 2.0
+RETRY_CAP = 60.0
+
+# Failed flushes of the same write before it is set aside
+MAX_ATTEMPTS = 10
+
+# Dataset each queued method writes, and whether it replaces all of it
+OPS = {
+    'save_players': ('players', True),
+    'save_games': ('games', True),
+    'save_matches': ('matches', True),
+    'append_matches': ('matches', False),
+    'update_match': ('matches', False),
+    'delete_match': ('matches', False),
+    'append_votes': ('votes', False),
+}
+
+# Back-to-back calls of these become one call with the rows concatenated
+MERGEABLE = {'append_matches', 'append_votes'}
+
+
+def coalesce(ops):
+    """Plan a flush as a list of (method, args, seqs) calls.
+
+    Each call carries the seqs of the ops it covers, including the ones it
+    made redundant, so they leave the log only once it has succeeded.
+    """
+    last_save = {}
+    for i, op in enumerate(ops):
+        dataset, full = OPS[op['method']]
+        if full:
+            last_save[dataset] = i
+
+    calls = []
+    superseded = {}
+    for i, op in enumerate(ops):
+        method = op['method']
+        dataset, _ = OPS[method]
+        if i < last_save.get(dataset, -1):
+            superseded.setdefault(dataset, []).append(op['seq'])
+            continue
+        seqs = superseded.pop(dataset, []) + [op['seq']]
+        if method in MERGEABLE and calls and calls[-1][0] == method:
+            calls[-1][1][0].extend(op['args'][0])
+            calls[-1][2].extend(seqs)
+        elif method in MERGEABLE:
+            calls.append((method, [list(op['args'][0])], seqs))
+        else:
+            calls.append((method, op['args'], seqs))
+    return calls
+
+
+def _history(matches):
+    rows = [row for m in matches for row in appearance_rows(m)]
+    return matches, rows_to_columns(rows, APPEARANCE_COLUMNS)
+
+
+def apply_pending(name, data, ops):
+    """Dataset ``name`` as loaded, with the queued ``ops`` applied on top.
+
+    A write that was flushed while the data was being read may be in both;
+    applying it again leaves the data as it was.
+    """
+    for op in ops:
+        method, args = op['method'], copy.deepcopy(op['args'])
+        if name == 'players' and method == 'save_players':
+            data = args[0]
+        elif name == 'games' and method == 'save_games':
+            data = args[0]
+        elif name == 'games' and method == 'append_votes':
+            data = fold_votes(data, [dict(zip(VOTE_COLUMNS, row)) for row in args[0]])
+        elif name == 'matches' and method == 'save_matches':
+            data = _history(args[0])
+        elif name == 'matches' and method == 'append_matches':
+            known = {m['id'] for m in data[0]}
+            new = [m for m in args[0] if m['id'] not in known]
+            if new:
+                columns = {c: list(v) for c, v in data[1].items()}
+                for row in (row for m in new for row in appearance_rows(m)):
+                    for c, v in zip(APPEARANCE_COLUMNS, row):
+                        columns[c].append(v)
+                data = data[0] + new, columns
+        elif name == 'matches' and method == 'update_match':
+            data = _history([args[0] if m['id'] == args[0]['id'] else m for m in data[0]])
+        elif name == 'matches' and method == 'delete_match':
+            data = _history([m for m in data[0] if m['id'] != args[0]])
+    if name == 'games':
+        data, _ = split_past_games(data)
+    return data
+
+
+class WriteBehindStorage(Storage):
+    """Queues writes for ``store`` in the log at ``wal_path`` and flushes them in the background.
+
+    Use one instance per log file: the queue lives in this object.
+    """
+
+    def __init__(self, store, wal_path, window=FLUSH_WINDOW):
+        self.store = store
+        self.wal_path = wal_path
+        self.window = window
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.failed_path = wal_path + '.failed'
+        self.ops = self._read_log()
+        self.next_seq = max([op['seq'] for op in self.ops], default=0) + 1
+        self.error = None
+        self.set_aside = None
+        self.watchers = []
+        self.failures = 0
+        threading.Thread(target=self._run, daemon=True).start()
+        if self.ops:
+            self.wakeup.set()
+
+    # ------------------------------------------------------------------
+    # Write-ahead log
+    # ------------------------------------------------------------------
+
+    def _read_log(self):
+        try:
+            with open(self.wal_path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        ops = []
+        for line in lines:
+            try:
+                ops.append(json.loads(line))
+            except ValueError:
+                # Cut off by a crash before the write returned, so never acknowledged
+                break
+        return ops
+
+    def _rewrite_log(self):
+        tmp = self.wal_path + '.tmp'
+        with open(tmp, 'w') as f:
+            for op in self.ops:
+                f.write(json.dumps(op) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.wal_path)
+
+    def _enqueue(self, method, *args):
+        with self.lock:
+            line = json.dumps({'seq': self.next_seq, 'method': method, 'args': list(args)})
+            self.next_seq += 1
+            with open(self.wal_path, 'a') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            # Queue the decoded copy: the caller keeps mutating its own lists
+            self.ops.append(json.loads(line))
+        self.wakeup.set()
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    def flush(self):
+        """Send every queued write to the backend now"""
+        with self.flush_lock:
+            with self.lock:
+                ops = list(self.ops)
+            if not ops:
+                return
+            done = set()
+            failed = None
+            try:
+                with PROFILER.timed('write_behind.flush'):
+                    for method, args, seqs in coalesce(ops):
+                        failed = seqs
+                        tokens = getattr(self.store, method)(*args)
+                        done.update(seqs)
+                        if tokens:
+                            for callback in self.watchers:
+                                callback(tokens)
+                    failed = None
+            except Exception as e:
+                self.error = e
+                raise
+            else:
+                self.error = None
+            finally:
+                with self.lock:
+                    if failed is not None:
+                        done.update(self._count_failure(failed))
+                    self.ops = [op for op in self.ops if op['seq'] not in done]
+                    if done or failed is not None:
+                        self._rewrite_log()
+
+    def _count_failure(self, seqs):
+        """Note another failed attempt at the ops in ``seqs``; the seqs set aside for good"""
+        failing = [op for op in self.ops if op['seq'] in seqs]
+        for op in failing:
+            op['attempts'] = op.get('attempts', 0) + 1
+        if max([op['attempts'] for op in failing], default=0) < MAX_ATTEMPTS:
+            return set()
+        # Kept for someone to look at and replay by hand, out of the way of the rest
+        with open(self.failed_path, 'a') as f:
+            for op in failing:
+                f.write(json.dumps(dict(op, error=str(self.error))) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.set_aside = RuntimeError(
+            f"{len(failing)} change(s) failed {MAX_ATTEMPTS} times and were set aside in {self.failed_path}: {self.error}"
+        )
+        return set(seqs)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(self.window)
+            self.wakeup.clear()
+            try:
+                self.flush()
+                self.failures = 0
+            except Exception:
+                time.sleep(min(RETRY_CAP, RETRY_BASE * 2 ** self.failures))
+                self.failures += 1
+                self.wakeup.set()
+
+    def sync_status(self):
+        with self.lock:
+            return len(self.ops), self.error or self.set_aside
+
+    def versions(self):
+        return self.store.versions()
+
+    def watch_versions(self, callback):
+        self.watchers.append(callback)
+
+    # ------------------------------------------------------------------
+    # Storage interface
+    # ------------------------------------------------------------------
+
+    def load_players(self):
+        return self.load_many(['players'])['players']
+
+    def save_players(self, players):
+        self._enqueue('save_players', players)
+
+    def load_games(self):
+        return self.load_many(['games'])['games']
+
+    def save_games(self, games):
+        self._enqueue('save_games', games)
+
+    def append_votes(self, rows):
+        self._enqueue('append_votes', rows)
+
+    def load_archive(self):
+        return self.load_many(['archive'])['archive']
+
+    def load_history(self):
+        return self.load_many(['matches'])['matches']
+
+    def load_many(self, names):
+        # Queue first, then read: a write can only be missing from the read
+        # if it is still in the queue
+        with self.lock:
+            ops = list(self.ops)
+        data = self.store.load_many(names)
+        return {name: apply_pending(name, value, ops) for name, value in data.items()}
+
+    def save_matches(self, matches):
+        self._enqueue('save_matches', matches)
+
+    def append_match(self, match):
+        self._enqueue('append_matches', [match])
+
+    def append_matches(self, matches):
+        self._enqueue('append_matches', list(matches))
+
+    def update_match(self, match):
+        self._enqueue('update_match', match)
+
+    def delete_match(self, match_id):
+        self._enqueue('delete_match', match_id)
+
+    def compact_matches(self):
+        self.flush()
+        self.store.compact_matches()